@@ -0,0 +1,258 @@
+import argparse
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+import pandas as pd
+from PhonePe_DB import section_config
+from PhonePe_Cache import data_version
+from PhonePe_Metrics import count, timer
+import PhonePe_VizApp as viz
+
+# brotli is only needed for br responses, gzip is used without it
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# API settings, the [api] section
+# host, port: address the API listens on
+# page_size: rows of a page when the request has no limit, max_page_size: largest limit accepted
+# compress_min_bytes: smaller bodies are sent uncompressed
+# max_entries: LRU bound of the encoded responses kept in memory
+# log_requests: log every request to stderr
+def api_config():
+    return section_config('api', {'host': '127.0.0.1', 'port': 8502, 'page_size': 100, 'max_page_size': 1000,
+                                   'compress_min_bytes': 1024, 'max_entries': 256, 'log_requests': False})
+
+# Request that can not be answered, sent as a json error with its status
+class APIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+TYPES = {'transactions': "***Transactions***", 'user': "***User***"}
+TOP_CATEGORIES = ('states', 'districts', 'pincodes')
+
+# Required query parameter
+def required(params, name):
+    if not params.get(name):
+        raise APIError(400, f"missing parameter: {name}")
+    return params[name]
+
+# Integer query parameter within bounds, default when it is not given
+def integer(params, name, default=None, low=None, high=None):
+    if name not in params and default is not None:
+        return default
+    try:
+        value = int(required(params, name))
+    except ValueError:
+        raise APIError(400, f"{name} must be an integer")
+    if (low is not None and value < low) or (high is not None and value > high):
+        if high is None:
+            raise APIError(400, f"{name} must be at least {low}")
+        if low is None:
+            raise APIError(400, f"{name} must be at most {high}")
+        raise APIError(400, f"{name} must be between {low} and {high}")
+    return value
+
+# Type, year and quarter of the period views
+def period(params):
+    type = required(params, 'type').lower()
+    if type not in TYPES:
+        raise APIError(400, f"type must be one of {', '.join(TYPES)}")
+    return TYPES[type], integer(params, 'year', low=2018, high=2100), integer(params, 'quarter', low=1, high=4)
+
+# Rows of the top categories of a period, the top 10 states, districts or pincodes
+def top_rows(params):
+    category = params.get('category', 'states')
+    if category not in TOP_CATEGORIES:
+        raise APIError(400, f"category must be one of {', '.join(TOP_CATEGORIES)}")
+    top_df = viz.display_data(*period(params))[1]
+    return top_df[top_df['cat_type'] == category].reset_index(drop=True)
+
+# Quarter of a ranking range, given as 2021Q3
+def quarter_of(params, name):
+    if name not in params:
+        return None
+    year, _, quarter = params[name].upper().partition('Q')
+    if not (year.isdigit() and quarter in ('1', '2', '3', '4')):
+        raise APIError(400, f"{name} must be a quarter like 2021Q3")
+    return int(year), int(quarter)
+
+# Arguments of a ranking: the table, the metric, k, bottom, the range of quarters and the state
+def ranking_arguments(params):
+    table = required(params, 'table')
+    if table not in viz.RANKINGS:
+        raise APIError(400, f"table must be one of {', '.join(viz.RANKINGS)}")
+    metric = required(params, 'metric')
+    if metric not in viz.RANKINGS[table]['metrics']:
+        raise APIError(400, f"metric must be one of {', '.join(viz.RANKINGS[table]['metrics'])}")
+    order = params.get('order', 'top')
+    if order not in ('top', 'bottom'):
+        raise APIError(400, "order must be top or bottom")
+    k = integer(params, 'k', 10, low=1, high=api_config()['max_page_size'])
+    return table, metric, k, order == 'bottom', quarter_of(params, 'from'), quarter_of(params, 'to'), params.get('state')
+
+# Number of an insight in the path
+def insight(argument):
+    try:
+        choice = int(argument)
+    except (TypeError, ValueError):
+        choice = 0
+    if choice not in viz.query_dic:
+        raise APIError(404, f"unknown insight: {argument}")
+    return choice
+
+# Endpoints by path: the tables the response is built from, named from the path argument and the query
+# parameters so the data version is known before anything is read, and the function building its rows
+ROUTES = {
+    'versions': (lambda argument, params: tuple(viz.table_versions()),
+                 lambda argument, params: pd.DataFrame(sorted(viz.table_versions().items()), columns=['table_name', 'version'])),
+    'map': (lambda argument, params: viz.map_tables(*period(params)),
+            lambda argument, params: viz.plot_data(*period(params))),
+    'aggregates': (lambda argument, params: viz.VIEW_TABLES[period(params)[0]],
+                   lambda argument, params: viz.display_data(*period(params))[0]),
+    'top': (lambda argument, params: viz.VIEW_TABLES[period(params)[0]],
+            lambda argument, params: top_rows(params)),
+    'insights': (lambda argument, params: viz.query_tables(insight(argument)),
+                 lambda argument, params: viz.insight_data(insight(argument))),
+    'ranking': (lambda argument, params: (ranking_arguments(params)[0],),
+                lambda argument, params: viz.ranking(*ranking_arguments(params))),
+    'states': (lambda argument, params: ("map_trans_state",),
+               lambda argument, params: pd.DataFrame({'state': viz.index_states()})),
+    'districts': (lambda argument, params: ("map_trans_state",),
+                  lambda argument, params: pd.DataFrame({'distrct': viz.index_districts(required(params, 'state'))})),
+    'district': (lambda argument, params: ("map_trans_state",),
+                 lambda argument, params: viz.district_series(required(params, 'state'), required(params, 'district'))),
+}
+
+# Encoded responses as (content encoding, body) by etag, in least recently used order
+responses = OrderedDict()
+responses_lock = threading.Lock()
+
+# Content encoding of the response, the best one the client accepts: br when brotli is installed, then gzip
+def negotiate(accept_encoding):
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        coding, _, weight = part.strip().partition(';')
+        if weight.strip().replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(coding.strip().lower())
+    if brotli and 'br' in accepted:
+        return 'br'
+    return 'gzip' if 'gzip' in accepted else 'identity'
+
+# Page of the rows as a json document with the paging of the request and the data version it was built from
+def page_body(df, version, offset, limit):
+    rows = df.iloc[offset:offset + limit].to_json(orient='records', date_format='iso')
+    return (f'{{"version":{version},"total":{len(df)},"offset":{offset},"limit":{limit},"data":' + rows + '}').encode()
+
+# Answering a GET request: returns the status, the headers and the body
+# The ETag is a digest of the path, the sorted query, the content encoding and the data version of the tables the
+# endpoint reads, so If-None-Match is answered with 304 before any data is read and a refresh changes the tags of
+# exactly the responses built from the refreshed tables. Encoded responses are kept in memory, a repeated request
+# is served without reading or encoding the data again
+def handle(target, headers):
+    settings = api_config()
+    url = urlsplit(target)
+    parts = [unquote(part) for part in url.path.strip('/').split('/')]
+    if len(parts) < 2 or parts[0] != 'api' or parts[1] not in ROUTES or len(parts) > 3:
+        raise APIError(404, f"unknown path: {url.path}")
+    endpoint, argument = parts[1], parts[2] if len(parts) == 3 else None
+    params = dict(parse_qsl(url.query))
+    tables, build = ROUTES[endpoint]
+    version = data_version(tables(argument, params), viz.table_versions)
+    offset = integer(params, 'offset', 0, low=0)
+    limit = integer(params, 'limit', settings['page_size'], low=1, high=settings['max_page_size'])
+    accepted = negotiate(headers.get('Accept-Encoding'))
+    key = f"{url.path}?{sorted(params.items())}|{accepted}|{version}"
+    etag = '"' + hashlib.sha1(key.encode()).hexdigest()[:20] + '"'
+    common = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    matches = [tag.strip() for tag in headers.get('If-None-Match', '').split(',')]
+    if etag in matches or '*' in matches:
+        count('phonepe_api_not_modified_total', endpoint=endpoint)
+        return 304, common, b''
+    with responses_lock:
+        cached = responses.get(etag)
+        if cached is not None:
+            responses.move_to_end(etag)
+    if cached is None:
+        encoding = accepted
+        count('phonepe_cache_misses_total', function=f"api_{endpoint}")
+        body = page_body(build(argument, params), version, offset, limit)
+        if len(body) < settings['compress_min_bytes']:
+            encoding = 'identity'
+        elif encoding == 'br':
+            body = brotli.compress(body, quality=5)
+        elif encoding == 'gzip':
+            body = gzip.compress(body, compresslevel=6)
+        cached = (encoding, body)
+        with responses_lock:
+            responses[etag] = cached
+            while len(responses) > settings['max_entries']:
+                responses.popitem(last=False)
+    count('phonepe_cache_requests_total', function=f"api_{endpoint}")
+    encoding, body = cached
+    response_headers = dict(common, **{'Content-Type': 'application/json'})
+    if encoding != 'identity':
+        response_headers['Content-Encoding'] = encoding
+    return 200, response_headers, body
+
+# Read only HTTP handler of the API, every request is answered by handle
+# Keep-alive connections; the headers and the body are separate writes, so Nagle's algorithm is disabled
+# to not hold the body back until the client acknowledges the headers
+class APIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def respond(self, send_body):
+        endpoint = urlsplit(self.path).path.strip('/').split('/')[1:2] or ['']
+        with timer('phonepe_api_seconds', endpoint=endpoint[0]):
+            try:
+                status, headers, body = handle(self.path, self.headers)
+            except APIError as e:
+                status, headers, body = e.status, {'Content-Type': 'application/json'}, json.dumps({'error': str(e)}).encode()
+            except Exception as e:
+                print("Error during answering an API request: ",e)
+                status, headers, body = 500, {'Content-Type': 'application/json'}, b'{"error": "internal error"}'
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+        count('phonepe_api_requests_total', endpoint=endpoint[0], status=status)
+
+    def do_GET(self):
+        self.respond(True)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def log_message(self, format, *args):
+        if api_config()['log_requests']:
+            super().log_message(format, *args)
+
+# HTTP server of the API, one thread per connection. Port 0 picks a free port, server_address tells which
+def make_server(host=None, port=None):
+    settings = api_config()
+    return ThreadingHTTPServer((host or settings['host'], settings['port'] if port is None else port), APIHandler)
+
+# python PhonePe_API.py [--host HOST] [--port PORT] serves the API of the data the dashboard reads
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read only HTTP/JSON API of the PhonePe Pulse views")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    args = parser.parse_args()
+    server = make_server(args.host, args.port)
+    print(f"Serving the API on http://{server.server_address[0]}:{server.server_address[1]}/api/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,96 @@
+import pandas as pd
+
+# Trend tables behind Insights 6 - 10: for every entity (the key columns) and quarter, the totals of a source table
+# with their growth, cumulative totals, rolling averages and ranks. rank_by: the columns within which the entities
+# are ranked each quarter, the districts within their state and the states within each transaction type
+TRENDS = {
+    'trend_transaction_type': {'source': 'agg_trans_country', 'keys': ('transaction_type',), 'rank_by': ()},
+    'trend_state': {'source': 'agg_trans_state', 'keys': ('state',), 'rank_by': ()},
+    'trend_state_type': {'source': 'agg_trans_state', 'keys': ('state', 'transaction_type'), 'rank_by': ('transaction_type',)},
+    'trend_district': {'source': 'map_trans_state', 'keys': ('state', 'distrct'), 'rank_by': ('state',)},
+}
+
+# Columns of every trend table after its keys, year and quarter
+# qoq_growth and yoy_growth: change of the amount against the previous quarter and the same quarter a year before,
+# as a fraction; cumulative_amount: running total; rolling_amount: average of the quarters reported in the last
+# four (the current one and the three before);
+# amount_rank: rank by amount (1 is the largest); rank_change: places gained since the previous quarter
+TREND_COLUMNS = [('transaction_count', 'BIGINT'), ('transaction_amount', 'DOUBLE'), ('qoq_growth', 'DOUBLE'),
+                 ('yoy_growth', 'DOUBLE'), ('cumulative_amount', 'DOUBLE'), ('rolling_amount', 'DOUBLE'),
+                 ('amount_rank', 'INT'), ('rank_change', 'INT')]
+
+# Value of a window column a number of quarters back, NULL when the entity was not reported in that quarter
+def lagged(column, quarters):
+    return f"CASE WHEN LAG(year * 4 + quarter, {quarters}) OVER w = year * 4 + quarter - {quarters} " \
+           f"THEN LAG({column}, {quarters}) OVER w END"
+
+# Building the SELECT that computes a trend table in one pass of window functions over the quarterly totals
+# The totals and their rank are computed in the inner query, the growth, running totals and rank changes
+# over the quarters of each entity in the outer one. Supported by MySQL 8, SQLite 3.28+ and DuckDB
+# The rolling average ranges over the quarter numbers, not the rows, so a quarter missing for an entity is not
+# replaced by an older one
+# MySQL types RANK() as BIGINT UNSIGNED, the rank is cast to SIGNED so a rank lost gives a negative rank_change
+# instead of an out of range error (SIGNED is an integer type in DuckDB and has integer affinity in SQLite)
+def trend_select(trend):
+    definition = TRENDS[trend]
+    keys = ", ".join(definition['keys'])
+    rank_partition = ", ".join(definition['rank_by'] + ('year', 'quarter'))
+    growth = lambda quarters: f"(transaction_amount - {lagged('transaction_amount', quarters)}) " \
+                              f"/ NULLIF({lagged('transaction_amount', quarters)}, 0)"
+    return f"SELECT {keys}, year, quarter, transaction_count, transaction_amount, " \
+           f"{growth(1)} AS qoq_growth, {growth(4)} AS yoy_growth, " \
+           f"SUM(transaction_amount) OVER (w ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS cumulative_amount, " \
+           f"AVG(transaction_amount) OVER (PARTITION BY {keys} ORDER BY year * 4 + quarter " \
+           f"RANGE BETWEEN 3 PRECEDING AND CURRENT ROW) AS rolling_amount, " \
+           f"amount_rank, {lagged('amount_rank', 1)} - amount_rank AS rank_change " \
+           f"FROM (SELECT {keys}, year, quarter, SUM(transaction_count) AS transaction_count, " \
+           f"SUM(transaction_amount) AS transaction_amount, " \
+           f"CAST(RANK() OVER (PARTITION BY {rank_partition} ORDER BY SUM(transaction_amount) DESC) AS SIGNED) AS amount_rank " \
+           f"FROM {definition['source']} GROUP BY {keys}, year, quarter) totals " \
+           f"WINDOW w AS (PARTITION BY {keys} ORDER BY year, quarter)"
+
+# Label of the quarter of every row, as "2021 Q2"
+def period_label(df):
+    return df['year'].astype(str) + " Q" + df['quarter'].astype(str)
+
+# Rows of the latest quarter in a trend frame
+def latest_period(df):
+    if df.empty:
+        return df
+    period = df['year'].astype(int) * 4 + df['quarter'].astype(int)
+    return df[period == period.max()]
+
+# Tables of the ranking engine: the columns naming their entities (the states, or the districts with their state)
+# and how each metric is combined over a range of quarters. The flows are summed, the registered users are a
+# running total so the value of the last quarter in the range is taken
+RANKINGS = {
+    'map_trans_country': {'keys': ('state',), 'metrics': {'transaction_count': 'sum', 'transaction_amount': 'sum'}},
+    'map_trans_state': {'keys': ('state', 'distrct'), 'metrics': {'transaction_count': 'sum', 'transaction_amount': 'sum'}},
+    'map_user_country': {'keys': ('state',), 'metrics': {'registered_users': 'last', 'app_opens': 'sum'}},
+    'map_user_state': {'keys': ('state', 'district'), 'metrics': {'registered_users': 'last', 'app_opens': 'sum'}},
+}
+
+# Top (or with bottom, the bottom) k entities of a ranking table by a metric, from the rows of the quarters ranked
+# The metric is combined per entity and the k entities are selected with nlargest / nsmallest, a heap selection
+# rather than a sort of every entity, keeping all the entities tied with the last one. Only those are sorted, by
+# value and then by name (categoricals keep the order of their categories, dense ids with the star schema, so the
+# names are compared as text). Equal values share a rank, the first entity in name order comes first
+def rank_entities(df, table, metric, k, bottom=False):
+    definition = RANKINGS[table]
+    keys = list(definition['keys'])
+    if df.empty:
+        return pd.DataFrame(columns=['rank'] + keys + [metric])
+    if definition['metrics'][metric] == 'last':
+        totals = df.sort_values(['year', 'quarter']).groupby(keys, observed=True)[metric].last().reset_index()
+    else:
+        totals = df.groupby(keys, observed=True)[metric].sum().reset_index()
+    selected = totals.nsmallest(k, metric, keep='all') if bottom else totals.nlargest(k, metric, keep='all')
+    selected = selected.sort_values([metric] + keys, ascending=[bottom] + [True] * len(keys),
+                                    key=lambda column: column.astype(str) if column.name in keys else column)
+    selected = selected.head(k).reset_index(drop=True)
+    selected.insert(0, 'rank', selected[metric].rank(method='min', ascending=bottom).astype(int))
+    return selected
+
+# Formatting a growth fraction as a percentage, "n/a" when there is nothing to compare with
+def growth_text(value):
+    return "n/a" if pd.isna(value) else f"{value:+.1%}"
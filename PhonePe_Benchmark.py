@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime
+from PhonePe_Data import SCHEMA, TABLES, ROLLUPS, DIMENSION_TABLES, db_connection, ingestion_config, read_dir, \
+    parse_files, parsed_rows, insert_batches, load_batches, resolve_load_mode, refresh_rollups, file_scope, table_ddl, \
+    rollup_ddl, dimension_ddl, read_dimensions, encode_batches, refresh_trends, trend_ddl, version_ddl, district_name
+from PhonePe_Analytics import TRENDS
+from PhonePe_DB import Error, backend, database_file, engine, star_schema
+from PhonePe_Synthetic import TRANSACTION_TYPES, generate_pulse, state_names
+
+BRANDS = ['Xiaomi', 'Samsung', 'Vivo', 'Oppo', 'OnePlus', 'Realme', 'Apple', 'Motorola', 'Lenovo', 'Huawei', 'Others']
+LOAD_MODES = ['executemany', 'multirow', 'infile']
+# frame is the vectorized load of the duckdb backend and only offered there, auto picks the fastest mode of the backend
+ALL_LOAD_MODES = LOAD_MODES + (['frame'] if backend() == 'duckdb' else []) + ['auto']
+BENCH_DATABASE = 'phonepe_bench'
+
+# Generating synthetic rows shaped like the Pulse tables, one chunk per (year, quarter)
+# The volume of the state level tables grows with the number of states and districts, the states are named like
+# the synthetic Pulse trees
+def synthetic_chunks(years=6, states=36, districts=20, seed=0):
+    names, top_states = state_names(states), state_names(10)
+    rnd = random.Random(seed)
+    count = lambda: rnd.randint(1000, 10**9)
+    amount = lambda: rnd.random() * 10**11
+    for year in range(2018, 2018 + years):
+        for quarter in range(1, 5):
+            chunk = {table: [] for table in TABLES}
+            top = [('states', name) for name in top_states] + [('districts', f"district {d}") for d in range(10)] \
+                + [('pincodes', str(500000 + p)) for p in range(10)]
+            chunk['agg_trans_country'] = [('india', year, quarter, t, count(), amount()) for t in TRANSACTION_TYPES]
+            chunk['agg_user_country'] = [('india', year, quarter, b, count(), rnd.random()) for b in BRANDS]
+            chunk['map_trans_country'] = [('india', year, quarter, name, count(), amount()) for name in names]
+            chunk['map_user_country'] = [('india', year, quarter, name, count(), count()) for name in names]
+            chunk['top_trans_country'] = [('india', year, quarter, c, n, count(), amount()) for c, n in top]
+            chunk['top_user_country'] = [('india', year, quarter, c, n, count()) for c, n in top]
+            for state in names:
+                chunk['agg_trans_state'] += [('india', state, year, quarter, t, count(), amount()) for t in TRANSACTION_TYPES]
+                chunk['agg_user_state'] += [('india', state, year, quarter, b, count(), rnd.random()) for b in BRANDS]
+                chunk['map_trans_state'] += [('india', state, year, quarter, f"district {d}", count(), amount()) for d in range(districts)]
+                chunk['map_user_state'] += [('india', state, year, quarter, f"district {d}", count(), count()) for d in range(districts)]
+                chunk['top_trans_state'] += [('india', state, year, quarter, c, n, count(), amount()) for c, n in top[10:]]
+                chunk['top_user_state'] += [('india', state, year, quarter, c, n, count()) for c, n in top[10:]]
+            yield chunk
+
+# Connection to the scratch database with the phonepe schema, its tables are emptied when it already exists
+# MySQL keeps it next to the phonepe database, the embedded backends in a file of its own
+def bench_connection(tables=TABLES, local_infile=False):
+    if backend() == 'mysql':
+        conn = db_connection(database=None)
+        with closing(conn.cursor()) as cursor:
+            cursor.execute(f"CREATE DATABASE IF NOT EXISTS {BENCH_DATABASE}")
+        conn.close()
+    conn = db_connection(database=BENCH_DATABASE, allow_local_infile=local_infile)
+    with closing(conn.cursor()) as cursor:
+        for table in tables + list(DIMENSION_TABLES):
+            cursor.execute(table_ddl(table) if table in SCHEMA else dimension_ddl(table) if table in DIMENSION_TABLES
+                           else trend_ddl(table) if table in TRENDS else rollup_ddl(table))
+            cursor.execute(f"{'TRUNCATE TABLE' if backend() == 'mysql' else 'DELETE FROM'} {table}")
+        # The dashboard keys its caches on the data versions, all the tables stay at version 0 here
+        cursor.execute(version_ddl())
+        cursor.execute("DELETE FROM data_version")
+    conn.commit()
+    return conn
+
+# Dropping the scratch database
+def drop_bench_database():
+    if backend() == 'mysql':
+        conn = db_connection(database=None)
+        try:
+            with closing(conn.cursor()) as cursor:
+                cursor.execute(f"DROP DATABASE IF EXISTS {BENCH_DATABASE}")
+        except Error as e:
+            print("Error during benchmark: ",e)
+        conn.close()
+    else:
+        engine(BENCH_DATABASE).dispose()
+        for suffix in ('', '.wal', '-wal', '-shm'):
+            if os.path.exists(database_file(BENCH_DATABASE) + suffix):
+                os.remove(database_file(BENCH_DATABASE) + suffix)
+
+# Loading the batches as extract_data does, their names encoded into dimension ids with the star schema
+def load_encoded(conn, batches, mode, batch_size):
+    if star_schema():
+        with closing(conn.cursor()) as cursor:
+            batches = encode_batches(conn, batches, read_dimensions(cursor), {})
+    return load_batches(conn, batches, mode, batch_size)
+
+# Timing each load mode on the same synthetic dataset, in a scratch database with the phonepe schema
+def benchmark_load_modes(modes=LOAD_MODES, years=6, states=36, districts=20, batch_size=5000):
+    results = {}
+    for mode in modes:
+        conn = bench_connection(local_infile=True)
+        try:
+            start = time.perf_counter()
+            batches = insert_batches(synthetic_chunks(years, states, districts), batch_size, 64 * 2**20)
+            stats = load_encoded(conn, batches, resolve_load_mode(conn, mode), batch_size)
+            seconds = time.perf_counter() - start
+            rows = sum(s[0] for s in stats.values())
+            results[mode] = {'rows': rows, 'failed': sum(s[2] for s in stats.values()),
+                             'seconds': round(seconds, 3), 'rows_per_sec': round(rows / seconds)}
+            print(f"{mode}: {rows} rows in {seconds:.2f}s ({rows / seconds:.0f} rows/s)")
+        except Error as e:
+            print("Error during benchmark: ",e)
+        conn.close()
+    drop_bench_database()
+    return results
+
+# Timing a function over a few runs, the minimum and the median are kept
+def timed(function, repeat=3, before=None):
+    runs = []
+    for i in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+    return {'min': round(min(runs), 6), 'median': round(statistics.median(runs), 6)}
+
+# Timing the stages of the ingestion on a synthetic Pulse tree: glob (read_dir), parse (json files to rows),
+# ingest (parse streamed into the inserts, as extract_data runs it), insert (time spent in the inserts), rollups and trends
+# The rows are loaded into the scratch database, the phonepe database is left untouched
+def benchmark_ingestion(root, workers, chunksize, batch_size, load_mode):
+    settings = ingestion_config()
+    stages = {}
+    start = time.perf_counter()
+    filepaths = read_dir(root)
+    stages['glob'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = sum(len(table_rows) for tables, timings in parse_files(filepaths, workers, chunksize, settings['json_decoder'])
+               for table_rows in tables.values())
+    stages['parse'] = time.perf_counter() - start
+
+    conn = bench_connection(TABLES + list(ROLLUPS) + list(TRENDS), local_infile=load_mode in ('auto', 'infile'))
+    try:
+        mode = resolve_load_mode(conn, load_mode)
+        start = time.perf_counter()
+        chunks = parsed_rows(parse_files(filepaths, workers, chunksize, settings['json_decoder']), chunksize, len(filepaths), {})
+        stats = load_encoded(conn, insert_batches(chunks, batch_size, settings['max_buffer_mb'] * 2**20), mode, batch_size)
+        stages['ingest'] = time.perf_counter() - start
+        stages['insert'] = sum(seconds for loaded, seconds, failed in stats.values())
+        start = time.perf_counter()
+        with closing(conn.cursor()) as cursor:
+            refresh_rollups(cursor, {file_scope(file) for file in filepaths} - {None})
+            conn.commit()
+        stages['rollups'] = time.perf_counter() - start
+        start = time.perf_counter()
+        with closing(conn.cursor()) as cursor:
+            refresh_trends(cursor, set(TABLES))
+            conn.commit()
+        stages['trends'] = time.perf_counter() - start
+    except Error as e:
+        print("Error during benchmark: ",e)
+    conn.close()
+    return {'files': len(filepaths), 'rows': rows, 'stages': {stage: round(seconds, 6) for stage, seconds in stages.items()}}
+
+# Timing the dashboard reads and figures on the data loaded by benchmark_ingestion, with a cold (cleared) and a warm cache
+def benchmark_queries(repeat=3):
+    import streamlit as st
+    import PhonePe_Cache
+    import PhonePe_VizApp as viz
+    # Pointing the dashboard reads at the scratch database, the figures are kept in memory only
+    dashboard_settings = dict(viz.dashboard_config(), source='mysql', database=BENCH_DATABASE)
+    viz.dashboard_config = lambda: dashboard_settings
+    figure_settings = dict(PhonePe_Cache.figure_config(), directory='')
+    PhonePe_Cache.figure_config = lambda: figure_settings
+    clear = lambda: (st.cache_data.clear(), viz.district_index.clear(), PhonePe_Cache.figures.clear())
+    state = state_names(1)[0]
+    district = district_name(f"{state.lower()} district 0")
+    calls = {f"query_processor({choice})": (viz.query_processor, (choice,)) for choice in (1, 2, 3, 4, 5, 6, 7, 9, 10)}
+    calls["index_states"] = (viz.index_states, ())
+    calls["index_districts"] = (viz.index_districts, (state,))
+    calls["district_series"] = (viz.district_series, (state, district))
+    calls["ranking(districts)"] = (viz.ranking, ("map_trans_state", "transaction_amount", 50, False, (2021, 1), (2022, 4), None))
+    for type in ("***Transactions***", "***User***"):
+        name = type.strip('*').lower()
+        calls[f"plot_data({name})"] = (viz.plot_data, (type, 2021, 2))
+        calls[f"display_data({name})"] = (viz.display_data, (type, 2021, 2))
+        calls[f"choropleth_figure({name})"] = (viz.choropleth_figure, (type, 2021, 2))
+    for choice in (1, 2, 5, 8, 10):
+        calls[f"insight_figure({choice})"] = (viz.insight_figure, (choice,))
+    calls["district_figure"] = (viz.district_figure, (state, district))
+    results = {}
+    for name, (function, args) in calls.items():
+        results[name] = {'cold': timed(lambda: function(*args), repeat, clear),
+                         'warm': timed(lambda: function(*args), repeat)}
+        print(f"{name}: cold {results[name]['cold']['median'] * 1000:.1f}ms, warm {results[name]['warm']['median'] * 1000:.2f}ms")
+    return results
+
+# Running the ingestion and query benchmarks on synthetic trees of each scale (multiples of the real data volume)
+# The trees are written to temporary directories under root, and removed afterwards unless keep is set
+def benchmark_suite(scales=(1, 10, 100), root=None, workers=None, chunksize=None, batch_size=None, load_mode=None,
+                    repeat=3, keep=False):
+    settings = ingestion_config()
+    workers = workers or settings['workers']
+    chunksize = chunksize or settings['chunksize']
+    batch_size = batch_size or settings['batch_size']
+    load_mode = load_mode or settings['load_mode']
+    results = {'started': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'python': platform.python_version(),
+               'settings': {'workers': workers, 'chunksize': chunksize, 'batch_size': batch_size, 'load_mode': load_mode,
+                            'json_decoder': settings['json_decoder']}, 'scales': {}}
+    for scale in scales:
+        directory = tempfile.mkdtemp(prefix=f"pulse_{scale}x_", dir=root)
+        try:
+            start = time.perf_counter()
+            generate_pulse(directory, scale)
+            generated = time.perf_counter() - start
+            result = benchmark_ingestion(directory, workers, chunksize, batch_size, load_mode)
+            result['stages'] = {'generate': round(generated, 6), **result['stages']}
+            print(f"{scale}x: {result['files']} files, {result['rows']} rows, "
+                  + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in result['stages'].items()))
+            result['queries'] = benchmark_queries(repeat)
+            results['scales'][f"{scale}x"] = result
+        finally:
+            if not keep:
+                shutil.rmtree(directory, ignore_errors=True)
+    drop_bench_database()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the load modes of PhonePe_Data on a synthetic dataset, "
+                                                 "or with --suite the ingestion stages and dashboard reads at several scales")
+    parser.add_argument("--modes", nargs="+", default=LOAD_MODES, choices=ALL_LOAD_MODES)
+    parser.add_argument("--suite", action="store_true", help="run the ingestion and query benchmark suite")
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 10, 100], help="multiples of the real data volume")
+    parser.add_argument("--root", help="directory for the synthetic Pulse trees (default: the temp directory)")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--load-mode", choices=ALL_LOAD_MODES)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per dashboard read")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic Pulse trees")
+    parser.add_argument("--years", type=int, default=6)
+    parser.add_argument("--states", type=int, default=36)
+    parser.add_argument("--districts", type=int, default=20, help="districts per state")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--output", help="write the results as json to this file")
+    args = parser.parse_args()
+    if args.suite:
+        results = benchmark_suite(args.scales, args.root, args.workers, None, args.batch_size, args.load_mode, args.repeat, args.keep)
+    else:
+        results = benchmark_load_modes(args.modes, args.years, args.states, args.districts, args.batch_size)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,185 @@
+import gzip
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from functools import wraps
+import plotly.io as pio
+import streamlit as st
+from PhonePe_DB import config_values, section_config
+from PhonePe_Metrics import metered_cache, gauge, count
+
+# Cache settings, the [cache] section
+# max_entries: LRU bound of every cached function, <function>_max_entries overrides it for one function
+# ttl_seconds: lifetime of a cached result, 0 keeps it until it is evicted or the data it was built from changes
+# version_ttl_seconds: how long the data versions are reused before they are read again
+def cache_config():
+    settings = section_config('cache', {'max_entries': 128, 'ttl_seconds': 0, 'version_ttl_seconds': 30})
+    settings.update((key, int(value)) for key, value in config_values('cache').items() if key.endswith('_max_entries'))
+    return settings
+
+# Figure cache settings, the [figures] section
+# directory: where the pre-rendered figures are kept for other sessions and processes, empty keeps them in memory only
+# compress: gzip the figure json, in memory and on disk
+# max_entries: LRU bound of the figures held in memory and of the files kept in the directory
+# warm: pre-render every figure of the dashboard after each refresh that changed the data
+# memory: also hold the figures in the memory of the process, off serves them from the directory alone so the
+# processes sharing it hold no copies (it is always on without a directory)
+def figure_config():
+    return section_config('figures', {'directory': '', 'compress': False, 'max_entries': 256, 'warm': False,
+                                      'memory': True})
+
+# LRU bound of a cached function: its own setting, else the default given in the code, else max_entries
+def entries_limit(name, default=None):
+    settings = cache_config()
+    return settings.get(f"{name}_max_entries", default or settings['max_entries'])
+
+# Size of the results held by each cached function, by key in least recently used order
+# st.cache_data keeps the results pickled, so the pickled size is what they cost; the LRU eviction is mirrored here
+usage = {}
+usage_lock = threading.Lock()
+
+# Recording a lookup of a cached result, size is given when the result was just built
+def track(name, key, limit, size=None):
+    with usage_lock:
+        entries = usage.setdefault(name, OrderedDict())
+        if size is not None:
+            entries[key] = size
+        if key in entries:
+            entries.move_to_end(key)
+        while len(entries) > limit:
+            entries.popitem(last=False)
+        gauge('phonepe_cache_entries', len(entries), function=name)
+        gauge('phonepe_cache_bytes', sum(entries.values()), function=name)
+
+# Entries and approximate bytes held by every cached function
+def cache_usage():
+    with usage_lock:
+        return {name: {'entries': len(entries), 'bytes': sum(entries.values())} for name, entries in usage.items()}
+
+# Data version of the results built from the given tables, the newest version of any of them
+def data_version(tables, versions):
+    current = versions()
+    return max((current.get(table, 0) for table in tables), default=0)
+
+# Caching a function with st.cache_data, bounded to its LRU limit and keyed on its arguments and on the data
+# version of the tables it reads: tables(*args) names them, versions() maps every table to its current version.
+# A refresh changes the key of exactly the results built from the refreshed tables. Their stale entries are never
+# read again and age out of the LRU, the results of the other tables stay cached
+def data_cache(tables, versions, max_entries=None):
+    def decorate(function):
+        name = function.__name__
+        limit = entries_limit(name, max_entries)
+        ttl = cache_config()['ttl_seconds'] or None
+
+        @wraps(function)
+        def build(*args, version=0):
+            result = function(*args)
+            track(name, (args, version), limit, len(pickle.dumps(result)))
+            return result
+        cached = metered_cache(lambda f: st.cache_data(f, max_entries=limit, ttl=ttl))(build)
+
+        @wraps(function)
+        def lookup(*args):
+            version = data_version(tables(*args), versions)
+            track(name, (args, version), limit)
+            return cached(*args, version=version)
+        lookup.clear = cached.clear
+        return lookup
+    return decorate
+
+# Pre-rendered figures: the serialised figure json by key, in least recently used order
+figures = OrderedDict()
+figures_lock = threading.Lock()
+
+# Keeping a serialised figure in memory, unless the figures are served from the directory alone
+def remember_figure(key, data):
+    settings = figure_config()
+    if not settings['memory'] and settings['directory']:
+        return
+    with figures_lock:
+        figures[key] = data
+        while len(figures) > settings['max_entries']:
+            figures.popitem(last=False)
+
+# File of a pre-rendered figure, named by the view and a digest of the rest of its key
+def figure_file(key):
+    settings = figure_config()
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+    return os.path.join(settings['directory'], f"{key[0]}-{digest}.json" + (".gz" if settings['compress'] else ""))
+
+# Serialised figure of a key from memory, else from the directory, None when it was never rendered
+def load_figure(key):
+    settings = figure_config()
+    with figures_lock:
+        if key in figures:
+            figures.move_to_end(key)
+            return figures[key]
+    if not settings['directory']:
+        return None
+    path = figure_file(key)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)
+    except OSError:
+        return None
+    remember_figure(key, data)
+    return data
+
+# Keeping a serialised figure in memory and in the directory, the file is replaced atomically so other
+# processes never read a half written figure; the least recently used files beyond max_entries are removed
+def store_figure(key, data):
+    settings = figure_config()
+    remember_figure(key, data)
+    track('figures', key, settings['max_entries'], len(data))
+    if not settings['directory']:
+        return
+    try:
+        os.makedirs(settings['directory'], exist_ok=True)
+        path = figure_file(key)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+        files = [entry for entry in os.scandir(settings['directory']) if not entry.name.endswith('.tmp')]
+        if len(files) > settings['max_entries']:
+            files.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in files[:len(files) - settings['max_entries']]:
+                os.remove(entry.path)
+    except OSError as e:
+        print("Error during writing the figure cache: ",e)
+
+# Caching the figures built by a function as their serialised json, keyed on the view, the arguments of the
+# function, the data version of the tables it reads and identity(): tables(*args) names the tables, versions() maps
+# every table to its current version, identity() returns the settings the figures depend on besides their data
+# (the database they are read from, the geometry). A cached figure is rebuilt from its json, which skips the construction of the figure
+# (plotly express, the traces and the geometry); a figure that was never rendered is built and stored
+# lookup.warm(*args) renders the figure when it is not cached yet, without returning it
+def figure_cache(view, tables, versions, identity):
+    def decorate(function):
+        def render(key, args):
+            count('phonepe_cache_misses_total', function=f"figure_{view}")
+            fig = function(*args)
+            data = fig.to_json().encode()
+            store_figure(key, gzip.compress(data) if figure_config()['compress'] else data)
+            return fig
+
+        @wraps(function)
+        def lookup(*args):
+            key = (view, *args, data_version(tables(*args), versions), identity())
+            count('phonepe_cache_requests_total', function=f"figure_{view}")
+            data = load_figure(key)
+            if data is None:
+                return render(key, args)
+            track('figures', key, figure_config()['max_entries'])
+            return pio.from_json(gzip.decompress(data) if data[:2] == b'\x1f\x8b' else data)
+
+        def warm(*args):
+            key = (view, *args, data_version(tables(*args), versions), identity())
+            if load_figure(key) is None:
+                render(key, args)
+        lookup.warm = warm
+        return lookup
+    return decorate
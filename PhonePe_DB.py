@@ -0,0 +1,192 @@
+import os
+import sqlite3
+import threading
+from configparser import ConfigParser
+from contextlib import closing, contextmanager
+from functools import lru_cache
+from mysql.connector import Error as MySQLError
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL
+
+# File locks: fcntl on POSIX, msvcrt on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# duckdb (with duckdb_engine for SQLAlchemy) is only needed for the duckdb backend
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Errors raised by the database drivers of all the backends, used as `except Error`
+Error = (MySQLError, sqlite3.Error) + ((duckdb.Error,) if duckdb else ())
+
+# Backends that run embedded in the process, with one database file per database
+EMBEDDED = ('duckdb', 'sqlite')
+
+# Extracting Database Configuration from file
+def config(filename='database.ini', section='mysql'):
+    parser = ConfigParser()
+    parser.read(filename)
+
+    # get section, default to mysql
+    conn_param = {}
+    if parser.has_section(section):
+        params = parser.items(section)
+        for p in params:
+            conn_param[p[0]] = p[1]
+    else:
+        raise Exception('Section {0} not found in the {1} file'.format(section, filename))
+
+    return conn_param
+
+# Values of a section of database.ini as written, the file is parsed once per process and section
+@lru_cache(maxsize=None)
+def config_values(section, filename='database.ini'):
+    parser = ConfigParser()
+    parser.read(filename)
+    return dict(parser.items(section)) if parser.has_section(section) else {}
+
+# Settings of a section of database.ini: the defaults, overridden by the values of the file converted to the
+# type of their default (booleans read like ConfigParser.getboolean). Keys without a default are ignored
+def section_config(section, defaults, filename='database.ini'):
+    settings = dict(defaults)
+    for key, value in config_values(section, filename).items():
+        if isinstance(settings.get(key), bool):
+            settings[key] = ConfigParser.BOOLEAN_STATES[value.lower()]
+        elif key in settings:
+            settings[key] = type(settings[key])(value)
+    return settings
+
+# Storage settings, the [storage] section
+# backend: mysql (server from the [mysql] section), duckdb or sqlite (embedded, files kept in directory)
+# schema: flat (names stored in the fact tables) or star (integer ids into dimension tables of the names)
+def storage_config():
+    return section_config('storage', {'backend': 'mysql', 'directory': '.', 'schema': 'flat'})
+
+# Storage backend of this process
+def backend():
+    return storage_config()['backend']
+
+# Whether the fact tables hold dimension ids instead of names
+def star_schema():
+    return storage_config()['schema'] == 'star'
+
+# File of a database of an embedded backend, database=None is the default phonepe database
+def database_file(database='phonepe'):
+    settings = storage_config()
+    return os.path.join(settings['directory'], f"{database or 'phonepe'}.{settings['backend']}")
+
+# Identity of a database: the backend and the file of an embedded database, or the server and the database name
+def database_identity(database='phonepe'):
+    if backend() in EMBEDDED:
+        return f"{backend()}:{os.path.abspath(database_file(database))}"
+    params = config_values('mysql')
+    return f"mysql:{params.get('host')}:{params.get('port', 3306)}/{database}"
+
+# Placeholders for the given number of bound parameters, in the paramstyle of the backend's driver
+def placeholders(count=1):
+    return ", ".join(['?' if backend() in EMBEDDED else '%s'] * count)
+
+# Connection pool settings, the [pool] section
+# query_timeout_ms bounds every dashboard SELECT on the server, 0 disables it
+def pool_config():
+    return section_config('pool', {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 30, 'pool_recycle': 1800,
+                                   'pool_pre_ping': True, 'query_timeout_ms': 30000})
+
+engines = {}
+counters = {}
+engines_lock = threading.Lock()
+
+# Shared engine, and with it the connection pool, for a database, created once per process
+# database=None connects to the server without selecting a database (used to create it)
+# Connections allowing LOAD DATA LOCAL INFILE are kept in a pool of their own
+# Embedded backends open the file of the database instead, every connection of the process shares it
+def engine(database='phonepe', local_infile=False):
+    embedded = backend() in EMBEDDED
+    if embedded:
+        database, local_infile = database or 'phonepe', False
+    key = (database, local_infile)
+    with engines_lock:
+        if key not in engines:
+            settings = pool_config()
+            if embedded:
+                os.makedirs(storage_config()['directory'], exist_ok=True)
+                url = f"{backend()}:///{database_file(database)}"
+                # sqlite connections are handed between the threads of the dashboard by the pool
+                connect_args = {'check_same_thread': False} if backend() == 'sqlite' else {}
+            else:
+                params = config()
+                url = URL.create("mysql+mysqlconnector", username=params.get('user'),
+                                 password=params.get('passwd', params.get('password')), host=params.get('host'),
+                                 port=int(params['port']) if 'port' in params else None, database=database)
+                connect_args = {'allow_local_infile': local_infile}
+            new_engine = create_engine(url, pool_size=settings['pool_size'], max_overflow=settings['max_overflow'],
+                                       pool_timeout=settings['pool_timeout'], pool_recycle=settings['pool_recycle'],
+                                       pool_pre_ping=settings['pool_pre_ping'], connect_args=connect_args)
+            if backend() == 'sqlite':
+                # Readers are not blocked by the refresh writing in the background
+                event.listen(new_engine, 'connect', lambda dbapi_connection, record: dbapi_connection.execute("PRAGMA journal_mode=WAL"))
+            counters[key] = {'connects': 0, 'checkouts': 0, 'checkins': 0}
+            for name, counter in (('connect', 'connects'), ('checkout', 'checkouts'), ('checkin', 'checkins')):
+                event.listen(new_engine, name, counting_listener(counters[key], counter))
+            engines[key] = new_engine
+    return engines[key]
+
+# Pool event listener incrementing one of the pool counters
+def counting_listener(pool_counters, counter):
+    def listener(*args):
+        pool_counters[counter] += 1
+    return listener
+
+# Raw DBAPI connection checked out of the shared pool, close() returns it to the pool
+def raw_connection(database='phonepe', local_infile=False):
+    return engine(database, local_infile).raw_connection()
+
+# Holding the refresh lock of a database for the body of a with statement, which is given whether it got it
+# Only one process refreshes a database at a time: MySQL locks it on the server (GET_LOCK, held by a connection of
+# the pool and released with it), the embedded backends with a lock file next to the database file
+@contextmanager
+def refresh_lock(database='phonepe'):
+    if backend() in EMBEDDED:
+        os.makedirs(storage_config()['directory'], exist_ok=True)
+        with open(f"{database_file(database)}.lock", 'a+') as f:
+            try:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                acquired = True
+            except OSError:
+                acquired = False
+            yield acquired
+        return
+    name = f"phonepe_refresh_{database}"
+    with closing(raw_connection(database)) as conn, closing(conn.cursor()) as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (name,))
+        acquired = bool(cursor.fetchone()[0])
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (name,))
+                cursor.fetchall()
+
+# Optimizer hint bounding the execution time of a SELECT, placed right after the SELECT keyword
+# Only MySQL knows the hint, the embedded backends run the queries in process
+def select_hint():
+    timeout = pool_config()['query_timeout_ms']
+    return f"/*+ MAX_EXECUTION_TIME({timeout}) */ " if timeout > 0 and backend() == 'mysql' else ""
+
+# Utilisation of every pool of this process
+def pool_stats():
+    stats = {}
+    for (database, local_infile), pool_engine in list(engines.items()):
+        pool = pool_engine.pool
+        name = f"{database or 'server'}{' (local infile)' if local_infile else ''}"
+        stats[name] = {'size': pool.size(), 'checked_out': pool.checkedout(), 'checked_in': pool.checkedin(),
+                       'overflow': pool.overflow(), **counters[(database, local_infile)]}
+    return stats
@@ -1,12 +1,24 @@
 import git
 import json
-import glob
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import time
 import pandas as pd
-import pathlib
 from pathlib import Path
-from mysql.connector import connect, Error
-from configparser import ConfigParser
-from os import path
+from sqlalchemy.exc import SQLAlchemyError
+from os import path, cpu_count
+from multiprocessing import get_context
+from collections import deque, namedtuple
+from contextlib import closing
+from functools import lru_cache
+from PhonePe_Snapshot import write_snapshot, geometry_name
+from PhonePe_Geo import geo_config, state_lookup, india_geometry
+from PhonePe_Analytics import TRENDS, TREND_COLUMNS, trend_select
+from PhonePe_DB import raw_connection, backend, placeholders, section_config, star_schema, storage_config, Error
+from PhonePe_Metrics import count, timer, write_metrics
 
 # Cloning the PhonePe Pulse Dataset from the github
 def clone():
@@ -18,302 +30,964 @@ def clone():
         git.Git("data").clone("https://github.com/PhonePe/pulse")
 
 # Extracting all the json file names with path from the downloaded / cloned dataset
-def read_dir():
-    filenames=[name for name in glob.glob('pulse\data\**\*.json', recursive=True)]
-    #print(len(filenames))
+def read_dir(root='pulse'):
+    filenames=sorted(str(name) for name in (Path(root) / 'data').rglob('*.json'))
     return filenames
 
-# Extracting Database Configuration from file
-def config(filename='database.ini', section='mysql'):
-    parser = ConfigParser()
-    parser.read(filename)
-  
-    # get section, default to mysql
-    conn_param = {}
-    if parser.has_section(section):
-        params = parser.items(section)
-        for p in params:
-            conn_param[p[0]] = p[1]
-    else:
-        raise Exception('Section {0} not found in the {1} file'.format(section, filename))
-  
-    return conn_param
-
-# Establishing MySQL Connection
-def db_connection():
-    params = config()
+# Establishing the database connection, checked out of the connection pool shared with the dashboard
+# database=None connects to the MySQL server without selecting a database
+def db_connection(database='phonepe', allow_local_infile=False):
     connection = None
     try:
-        connection = connect(**params)
-    except Error as e:
+        connection = raw_connection(database, allow_local_infile)
+    except (Error, SQLAlchemyError) as e:
         print("Error during establishing MySQL connection: ",e)
     return(connection)
 
-# Creating tables in MySQL
+# Table definitions: the columns with their types, the natural primary key and the secondary indexes
+# Keys lead with the columns the dashboard filters on, (year, quarter) for the country tables and
+# state for the state tables; the state tables get an extra (year, quarter) index for period filters
+SCHEMA = {
+    'agg_trans_country': {
+        'columns': [('country', 'VARCHAR(20)'), ('year', 'YEAR'), ('quarter', 'TINYINT'), ('transaction_type', 'VARCHAR(40)'),
+                    ('transaction_count', 'BIGINT'), ('transaction_amount', 'DOUBLE')],
+        'key': ('year', 'quarter', 'country', 'transaction_type'),
+        'indexes': {}},
+    'agg_trans_state': {
+        'columns': [('country', 'VARCHAR(20)'), ('state', 'VARCHAR(40)'), ('year', 'YEAR'), ('quarter', 'TINYINT'),
+                    ('transaction_type', 'VARCHAR(40)'), ('transaction_count', 'BIGINT'), ('transaction_amount', 'DOUBLE')],
+        'key': ('state', 'year', 'quarter', 'country', 'transaction_type'),
+        'indexes': {'idx_period': ('year', 'quarter'),
+                    'idx_type_year': ('transaction_type', 'year', 'transaction_amount', 'transaction_count')}},
+    'agg_user_country': {
+        'columns': [('country', 'VARCHAR(20)'), ('year', 'YEAR'), ('quarter', 'TINYINT'), ('brand_name', 'VARCHAR(40)'),
+                    ('user_count', 'BIGINT'), ('percentage', 'DOUBLE')],
+        'key': ('year', 'quarter', 'country', 'brand_name'),
+        'indexes': {}},
+    'agg_user_state': {
+        'columns': [('country', 'VARCHAR(20)'), ('state', 'VARCHAR(40)'), ('year', 'YEAR'), ('quarter', 'TINYINT'),
+                    ('brand_name', 'VARCHAR(40)'), ('user_count', 'BIGINT'), ('percentage', 'DOUBLE')],
+        'key': ('state', 'year', 'quarter', 'country', 'brand_name'),
+        'indexes': {'idx_period': ('year', 'quarter'),
+                    'idx_brand_year': ('brand_name', 'year', 'user_count', 'percentage')}},
+    'map_trans_country': {
+        'columns': [('country', 'VARCHAR(20)'), ('year', 'YEAR'), ('quarter', 'TINYINT'), ('state', 'VARCHAR(40)'),
+                    ('transaction_count', 'BIGINT'), ('transaction_amount', 'DOUBLE')],
+        'key': ('year', 'quarter', 'country', 'state'),
+        'indexes': {}},
+    'map_trans_state': {
+        'columns': [('country', 'VARCHAR(20)'), ('state', 'VARCHAR(40)'), ('year', 'YEAR'), ('quarter', 'TINYINT'),
+                    ('distrct', 'VARCHAR(40)'), ('transaction_count', 'BIGINT'), ('transaction_amount', 'DOUBLE')],
+        'key': ('state', 'year', 'quarter', 'distrct', 'country'),
+        'indexes': {'idx_period': ('year', 'quarter'),
+                    'idx_district': ('state', 'distrct', 'year', 'quarter', 'transaction_count', 'transaction_amount')}},
+    'map_user_country': {
+        'columns': [('country', 'VARCHAR(20)'), ('year', 'YEAR'), ('quarter', 'TINYINT'), ('state', 'VARCHAR(40)'),
+                    ('registered_users', 'BIGINT'), ('app_opens', 'BIGINT')],
+        'key': ('year', 'quarter', 'country', 'state'),
+        'indexes': {}},
+    'map_user_state': {
+        'columns': [('country', 'VARCHAR(20)'), ('state', 'VARCHAR(40)'), ('year', 'YEAR'), ('quarter', 'TINYINT'),
+                    ('district', 'VARCHAR(40)'), ('registered_users', 'BIGINT'), ('app_opens', 'BIGINT')],
+        'key': ('state', 'year', 'quarter', 'district', 'country'),
+        'indexes': {'idx_period': ('year', 'quarter'),
+                    'idx_district': ('state', 'district', 'year', 'quarter', 'registered_users', 'app_opens')}},
+    'top_trans_country': {
+        'columns': [('country', 'VARCHAR(20)'), ('year', 'YEAR'), ('quarter', 'TINYINT'), ('cat_type', 'VARCHAR(15)'),
+                    ('type_name', 'VARCHAR(40)'), ('transaction_count', 'BIGINT'), ('transaction_amount', 'DOUBLE')],
+        'key': ('year', 'quarter', 'cat_type', 'type_name', 'country'),
+        'indexes': {}},
+    'top_trans_state': {
+        'columns': [('country', 'VARCHAR(20)'), ('state', 'VARCHAR(40)'), ('year', 'YEAR'), ('quarter', 'TINYINT'),
+                    ('cat_type', 'VARCHAR(15)'), ('type_name', 'VARCHAR(40)'), ('transaction_count', 'BIGINT'),
+                    ('transaction_amount', 'DOUBLE')],
+        'key': ('state', 'year', 'quarter', 'cat_type', 'type_name', 'country'),
+        'indexes': {'idx_period': ('year', 'quarter')}},
+    'top_user_country': {
+        'columns': [('country', 'VARCHAR(20)'), ('year', 'YEAR'), ('quarter', 'TINYINT'), ('cat_type', 'VARCHAR(15)'),
+                    ('type_name', 'VARCHAR(40)'), ('registered_users', 'BIGINT')],
+        'key': ('year', 'quarter', 'cat_type', 'type_name', 'country'),
+        'indexes': {}},
+    'top_user_state': {
+        'columns': [('country', 'VARCHAR(20)'), ('state', 'VARCHAR(40)'), ('year', 'YEAR'), ('quarter', 'TINYINT'),
+                    ('cat_type', 'VARCHAR(15)'), ('type_name', 'VARCHAR(40)'), ('registered_users', 'BIGINT')],
+        'key': ('state', 'year', 'quarter', 'cat_type', 'type_name', 'country'),
+        'indexes': {'idx_period': ('year', 'quarter')}},
+}
+
+# Target tables in the order they are loaded
+TABLES = list(SCHEMA)
+
+# Dimensions of the star schema: the dimension table of each name column and the type of its ids
+# With the star schema the fact and rollup tables keep their column names, holding the ids instead of the names
+# Ids are assigned densely from 1 in the order the names are first loaded, the dashboard decodes them into categoricals
+DIMENSIONS = {'country': ('dim_country', 'SMALLINT'), 'state': ('dim_state', 'SMALLINT'),
+              'distrct': ('dim_district', 'INT'), 'district': ('dim_district', 'INT'),
+              'transaction_type': ('dim_transaction_type', 'SMALLINT'), 'brand_name': ('dim_brand', 'SMALLINT'),
+              'cat_type': ('dim_cat_type', 'SMALLINT'), 'type_name': ('dim_type_name', 'INT')}
+DIMENSION_TABLES = {table: idtype for table, idtype in DIMENSIONS.values()}
+
+# Column type in the dialect of the backend
+# The embedded backends have no YEAR type, and compare text case-insensitively like the default MySQL collation
+def column_type(sqltype):
+    if backend() == 'mysql':
+        return sqltype
+    if sqltype == 'YEAR':
+        return 'SMALLINT'
+    if sqltype.startswith(('VARCHAR', 'CHAR')):
+        return f"{sqltype} COLLATE NOCASE"
+    return sqltype
+
+# Stored type of a column, the id type of its dimension with the star schema
+def stored_type(column, sqltype):
+    return DIMENSIONS[column][1] if column in DIMENSIONS and star_schema() else sqltype
+
+# Building the CREATE TABLE statement of a table from its definition
+# The secondary indexes are declared inline on MySQL and created by index_ddl on the embedded backends
+def table_ddl(table, name=None):
+    definition = SCHEMA[table]
+    lines = [f"{column} {column_type(stored_type(column, sqltype))}" for column, sqltype in definition['columns']]
+    lines.append(f"PRIMARY KEY ({', '.join(definition['key'])})")
+    if backend() == 'mysql':
+        lines += [f"INDEX {index} ({', '.join(columns)})" for index, columns in definition['indexes'].items()]
+    return f"CREATE TABLE IF NOT EXISTS {name or table}({', '.join(lines)})"
+
+# Building the CREATE INDEX statements of a table on SQLite, whose index names are global to the database
+# DuckDB scans its columnar storage instead, secondary indexes would only slow its inserts down
+def index_ddl(table):
+    if backend() != 'sqlite':
+        return []
+    return [f"CREATE INDEX IF NOT EXISTS {table}_{index} ON {table}({', '.join(columns)})"
+            for index, columns in SCHEMA[table]['indexes'].items()]
+
+# Building an idempotent INSERT from VALUES or a SELECT, rows already present under the key are updated
+def upsert_sql(table, columns, key, rows_sql):
+    updates = [column for column in columns if column not in key]
+    if backend() == 'mysql':
+        return f"INSERT INTO {table} {rows_sql} ON DUPLICATE KEY UPDATE " + ", ".join(f"{column}=VALUES({column})" for column in updates)
+    return f"INSERT INTO {table} {rows_sql} ON CONFLICT ({', '.join(key)}) DO UPDATE SET " \
+        + ", ".join(f"{column}=excluded.{column}" for column in updates)
+
+# Building an idempotent INSERT for a table, rows already present under the primary key are updated
+def upsert_query(table, rows_sql):
+    definition = SCHEMA[table]
+    return upsert_sql(table, [column for column, sqltype in definition['columns']], definition['key'], rows_sql)
+
+# Rollup tables behind the Insights queries: the source table, the grouping columns and the aggregates
+# Column names follow the aliases the dashboard has always used for these queries
+ROLLUPS = {
+    'rollup_trans_year': {'source': 'agg_trans_country', 'group': ('year', 'transaction_type'),
+                          'measures': [('Amount', 'SUM(transaction_amount)', 'DOUBLE'), ('Count', 'SUM(transaction_count)', 'BIGINT')]},
+    'rollup_trans_state_year': {'source': 'agg_trans_state', 'group': ('state', 'year', 'transaction_type'),
+                                'measures': [('Amount', 'SUM(transaction_amount)', 'DOUBLE'), ('Count', 'SUM(transaction_count)', 'BIGINT')]},
+    'rollup_user_year': {'source': 'agg_user_country', 'group': ('year', 'brand_name'),
+                         'measures': [('User_Count', 'SUM(user_count)', 'BIGINT'), ('Percentage', 'SUM(percentage)', 'DOUBLE')]},
+    'rollup_user_state_year': {'source': 'agg_user_state', 'group': ('state', 'year', 'brand_name'),
+                               'measures': [('User_Count', 'SUM(user_count)', 'BIGINT'), ('Percentage', 'SUM(percentage)', 'DOUBLE')]},
+    'rollup_top_trans_year': {'source': 'top_trans_country', 'group': ('year', 'cat_type', 'type_name'),
+                              'measures': [('Count', 'SUM(transaction_count)', 'BIGINT'), ('Amount', 'SUM(transaction_amount)', 'DOUBLE')]},
+}
+
+# Building the CREATE TABLE statement of a rollup table, keyed on its grouping columns
+def rollup_ddl(rollup):
+    definition = ROLLUPS[rollup]
+    types = dict(SCHEMA[definition['source']]['columns'])
+    lines = [f"{column} {column_type(stored_type(column, types[column]))}" for column in definition['group']]
+    lines += [f"{column} {sqltype}" for column, expression, sqltype in definition['measures']]
+    lines.append(f"PRIMARY KEY ({', '.join(definition['group'])})")
+    return f"CREATE TABLE IF NOT EXISTS {rollup}({', '.join(lines)})"
+
+# Building the CREATE TABLE statement of a trend table, keyed on its entity and quarter
+def trend_ddl(trend):
+    definition = TRENDS[trend]
+    types = dict(SCHEMA[definition['source']]['columns'])
+    lines = [f"{column} {column_type(stored_type(column, types[column]))}" for column in definition['keys'] + ('year', 'quarter')]
+    lines += [f"{column} {sqltype}" for column, sqltype in TREND_COLUMNS]
+    lines.append(f"PRIMARY KEY ({', '.join(definition['keys'] + ('year', 'quarter'))})")
+    return f"CREATE TABLE IF NOT EXISTS {trend}({', '.join(lines)})"
+
+# Building the CREATE TABLE statement of a dimension table of the star schema
+def dimension_ddl(table):
+    return f"CREATE TABLE IF NOT EXISTS {table}(id {DIMENSION_TABLES[table]} PRIMARY KEY, name {column_type('VARCHAR(60)')})"
+
+# Building the CREATE TABLE statement of the version of the data in each table, bumped by every refresh that
+# changes the table
+def version_ddl():
+    return "CREATE TABLE IF NOT EXISTS data_version(table_name VARCHAR(40) PRIMARY KEY, version BIGINT)"
+
+# Reading the ids of the names of every dimension table, keyed on the lower cased names
+# like the case-insensitive comparisons of the backends
+def read_dimensions(cursor):
+    dimensions = {}
+    for table in DIMENSION_TABLES:
+        cursor.execute(f"SELECT name, id FROM {table}")
+        dimensions[table] = {name.lower(): id for name, id in cursor.fetchall()}
+    return dimensions
+
+# Positions of the dimension columns of a table and their dimension tables
+@lru_cache(maxsize=None)
+def dimension_positions(table):
+    return [(index, DIMENSIONS[column][0]) for index, (column, sqltype) in enumerate(SCHEMA[table]['columns'])
+            if column in DIMENSIONS]
+
+# Replacing the names in the dimension columns of every batch with their ids, for the star schema
+# Names seen for the first time get the next id and are stored in their dimension table before the batch
+# is loaded; the dimension tables that got new names are added to extended
+def encode_batches(conn, batches, dimensions, extended):
+    for table, rows in batches:
+        positions = dimension_positions(table)
+        new = {}
+        encoded = []
+        for row in rows:
+            row = list(row)
+            for index, dimension in positions:
+                ids = dimensions[dimension]
+                key = row[index].lower()
+                if key not in ids:
+                    ids[key] = len(ids) + 1
+                    new.setdefault(dimension, []).append((ids[key], row[index]))
+                row[index] = ids[key]
+            encoded.append(tuple(row))
+        if new:
+            with closing(conn.cursor()) as cursor:
+                for dimension, members in new.items():
+                    upsert_rows(cursor, dimension, ['id', 'name'], ['id'], members)
+            conn.commit()
+            extended.update(new)
+        yield table, encoded
+
+# Checking whether a table has any row
+def has_rows(cursor, table):
+    cursor.execute(f"SELECT 1 FROM {table} LIMIT 1")
+    return bool(cursor.fetchall())
+
+# Refreshing the rollups of the source tables touched by the given file scopes
+# Only the years of those scopes are aggregated again, an empty rollup is built from the whole source table
+# Returns the refreshed rollups
+def refresh_rollups(cursor, scopes):
+    refreshed = []
+    years = {}
+    for table, country, state, year, quarter in scopes:
+        years.setdefault(table, set()).add(year)
+    for rollup, definition in ROLLUPS.items():
+        empty = not has_rows(cursor, rollup)
+        source_years = sorted(years.get(definition['source'], ()))
+        if not empty and not source_years:
+            continue
+        where, params = "", ()
+        if not empty:
+            where, params = f" WHERE year IN ({placeholders(len(source_years))})", source_years
+        group = ", ".join(definition['group'])
+        measures = ", ".join(expression for column, expression, sqltype in definition['measures'])
+        cursor.execute(f"DELETE FROM {rollup}{where}", params)
+        cursor.execute(f"INSERT INTO {rollup} SELECT {group}, {measures} FROM {definition['source']}{where} GROUP BY {group}", params)
+        if source_years or has_rows(cursor, rollup):
+            refreshed.append(rollup)
+    return refreshed
+
+# Computing again the trend tables of the changed source tables, an empty trend table is always computed
+# Growth and ranks depend on the neighbouring quarters, so a trend table is rebuilt as a whole
+# Returns the refreshed trend tables
+def refresh_trends(cursor, tables):
+    refreshed = []
+    for trend, definition in TRENDS.items():
+        if definition['source'] not in tables and has_rows(cursor, trend):
+            continue
+        columns = ", ".join(definition['keys'] + ('year', 'quarter') + tuple(column for column, sqltype in TREND_COLUMNS))
+        cursor.execute(f"DELETE FROM {trend}")
+        cursor.execute(f"INSERT INTO {trend} ({columns}) {trend_select(trend)}")
+        if has_rows(cursor, trend):
+            refreshed.append(trend)
+    return refreshed
+
+# Bumping the data version of the changed tables, all of them get the same new version number
+# The versions of a new database start at the current time, so a recreated database does not reuse the versions
+# the snapshots and the cached figures of the one it replaces are named by
+def bump_versions(cursor, tables):
+    cursor.execute("SELECT MAX(version) FROM data_version")
+    version = (cursor.fetchone()[0] or int(time.time())) + 1
+    upsert_rows(cursor, 'data_version', ['table_name', 'version'], ['table_name'], [(table, version) for table in tables])
+    return version
+
+# Current data version, the highest version of any table
+def current_version(cursor):
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM data_version")
+    return cursor.fetchone()[0]
+
+# Migrating tables created before the primary keys were introduced
+# Each one is rebuilt with its keys and indexes, duplicated rows collapse into the last loaded one
+def migrate_mysqlschema(cursor):
+    cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema='phonepe'")
+    existing = {row[0] for row in cursor.fetchall()}
+    cursor.execute("SELECT table_name FROM information_schema.table_constraints \
+                    WHERE table_schema='phonepe' AND constraint_type='PRIMARY KEY'")
+    keyed = {row[0] for row in cursor.fetchall()}
+    for table in TABLES:
+        if table not in existing or table in keyed:
+            continue
+        definition = SCHEMA[table]
+        not_null = " AND ".join(f"{column} IS NOT NULL" for column in definition['key'])
+        updates = ", ".join(f"{column}=VALUES({column})" for column, sqltype in definition['columns'] if column not in definition['key'])
+        print(f"Migrating {table} to its primary key")
+        cursor.execute(f"DROP TABLE IF EXISTS {table}_migrate")
+        cursor.execute(table_ddl(table, f"{table}_migrate"))
+        cursor.execute(f"INSERT INTO {table}_migrate SELECT * FROM {table} WHERE {not_null} ON DUPLICATE KEY UPDATE {updates}")
+        cursor.execute(f"RENAME TABLE {table} TO {table}_old, {table}_migrate TO {table}")
+        cursor.execute(f"DROP TABLE {table}_old")
+
+# Emptying the loaded data together with the manifest, so the next run loads every file again
+# Used for a database loaded before the names were made canonical, and with drop set when the schema
+# option changed, the fact and rollup tables are then dropped to be created again with the new column types
+def reset_data(cursor, reason, drop=False):
+    print(f"Reloading the data {reason}")
+    for table in TABLES + list(ROLLUPS) + list(TRENDS):
+        cursor.execute(f"DROP TABLE IF EXISTS {table}" if drop else f"DELETE FROM {table}")
+    for table in list(DIMENSION_TABLES) + ['ingest_manifest']:
+        cursor.execute(f"DELETE FROM {table}")
+
+# Creating the tables in the database of the storage backend
 def create_mysqlschema():
-    conn = db_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("CREATE DATABASE IF NOT EXISTS phonepe")
-            cursor.execute("USE phonepe")
-    except Error as e:
-        print("Error during Db creation: ",e)
-    
-    query1 = "CREATE TABLE IF NOT EXISTS agg_trans_country(\
-        country VARCHAR(20),\
-        year YEAR,\
-        quarter TINYINT,\
-        transaction_type VARCHAR(40),\
-        transaction_count BIGINT,\
-        transaction_amount DOUBLE)"
-    query2 = "CREATE TABLE IF NOT EXISTS agg_trans_state(\
-        country VARCHAR(20),\
-        state VARCHAR(40),\
-        year YEAR,\
-        quarter TINYINT,\
-        transaction_type VARCHAR(40),\
-        transaction_count BIGINT,\
-        transaction_amount DOUBLE)"
-    query3 = "CREATE TABLE IF NOT EXISTS agg_user_country(\
-        country VARCHAR(20),\
-        year YEAR,\
-        quarter TINYINT,\
-        brand_name VARCHAR(40),\
-        user_count BIGINT,\
-        percentage DOUBLE)"
-    query4 = "CREATE TABLE IF NOT EXISTS agg_user_state(\
-        country VARCHAR(20),\
-        state VARCHAR(40),\
-        year YEAR,\
-        quarter TINYINT,\
-        brand_name VARCHAR(40),\
-        user_count BIGINT,\
-        percentage DOUBLE)"
-    query5 = "CREATE TABLE IF NOT EXISTS map_trans_country(\
-        country VARCHAR(20),\
-        year YEAR,\
-        quarter TINYINT,\
-        state VARCHAR(40),\
-        transaction_count BIGINT,\
-        transaction_amount DOUBLE)"
-    query6 = "CREATE TABLE IF NOT EXISTS map_trans_state(\
-        country VARCHAR(20),\
-        state VARCHAR(40),\
-        year YEAR,\
-        quarter TINYINT,\
-        distrct VARCHAR(40),\
-        transaction_count BIGINT,\
-        transaction_amount DOUBLE)"
-    query7 = "CREATE TABLE IF NOT EXISTS map_user_country(\
-        country VARCHAR(20),\
-        year YEAR,\
-        quarter TINYINT,\
-        state VARCHAR(40),\
-        registered_users BIGINT,\
-        app_opens BIGINT)"
-    query8 = "CREATE TABLE IF NOT EXISTS map_user_state(\
-        country VARCHAR(20),\
-        state VARCHAR(40),\
-        year YEAR,\
-        quarter TINYINT,\
-        district VARCHAR(40),\
-        registered_users BIGINT,\
-        app_opens BIGINT)"
-    query9 = "CREATE TABLE IF NOT EXISTS top_trans_country(\
-        country VARCHAR(20),\
-        year YEAR,\
-        quarter TINYINT,\
-        cat_type VARCHAR(15),\
-        type_name VARCHAR(40),\
-        transaction_count BIGINT,\
-        transaction_amount DOUBLE)"
-    query10 = "CREATE TABLE IF NOT EXISTS top_trans_state(\
-        country VARCHAR(20),\
-        state VARCHAR(40),\
-        year YEAR,\
-        quarter TINYINT,\
-        cat_type VARCHAR(15),\
-        type_name VARCHAR(40),\
-        transaction_count BIGINT,\
-        transaction_amount DOUBLE)"
-    query11 = "CREATE TABLE IF NOT EXISTS top_user_country(\
-        country VARCHAR(20),\
-        year YEAR,\
-        quarter TINYINT,\
-        cat_type VARCHAR(15),\
-        type_name VARCHAR(40),\
-        registered_users BIGINT)"
-    query12 = "CREATE TABLE IF NOT EXISTS top_user_state(\
-        country VARCHAR(20),\
-        state VARCHAR(40),\
-        year YEAR,\
-        quarter TINYINT,\
-        cat_type VARCHAR(15),\
-        type_name VARCHAR(40),\
-        registered_users BIGINT)"
+    conn = db_connection(database=None)
+    if backend() == 'mysql':
+        try:
+            with closing(conn.cursor()) as cursor:
+                cursor.execute("CREATE DATABASE IF NOT EXISTS phonepe")
+                cursor.execute("USE phonepe")
+        except Error as e:
+            print("Error during Db creation: ",e)
+
+    # Manifest of the ingested json files, used to load only the new or changed files on refresh
+    manifest_query = "CREATE TABLE IF NOT EXISTS ingest_manifest(\
+        path VARCHAR(255) PRIMARY KEY,\
+        size BIGINT,\
+        mtime DOUBLE,\
+        hash CHAR(40))"
+    # Reference of the canonical state names the ingestion maps the Pulse names to
+    reference_query = f"CREATE TABLE IF NOT EXISTS ref_state(\
+        name VARCHAR(60) PRIMARY KEY,\
+        state {column_type('VARCHAR(40)')})"
 
     try:
-        with conn.cursor() as cursor:
-            query_lst=[query1, query2, query3, query4, query5, query6, query7, query8, query9, query10, query11, query12]
-            operation = ";".join(query_lst)
-            cursor.execute(operation, multi=True)
-                
+        with closing(conn.cursor()) as cursor:
+            for query in [manifest_query, version_ddl(), reference_query] + [dimension_ddl(table) for table in DIMENSION_TABLES]:
+                cursor.execute(query)
+            # Data loaded with the other schema option holds dimension ids where names are expected, or the reverse
+            if has_rows(cursor, 'ingest_manifest') and has_rows(cursor, 'dim_country') != star_schema():
+                reset_data(cursor, f"into the {storage_config()['schema']} schema", drop=True)
+            if backend() == 'mysql':
+                migrate_mysqlschema(cursor)
+            queries = [table_ddl(table) for table in TABLES] + [query for table in TABLES for query in index_ddl(table)]
+            for query in queries + [rollup_ddl(rollup) for rollup in ROLLUPS] + [trend_ddl(trend) for trend in TRENDS]:
+                cursor.execute(query)
+            if not has_rows(cursor, 'ref_state') and has_rows(cursor, 'ingest_manifest'):
+                reset_data(cursor, "with canonical state and district names")
+            upsert_rows(cursor, 'ref_state', ['name', 'state'], ['name'], sorted(state_reference().items()))
+        conn.commit()
     except Error as e:
         print("Error during table creation: ",e)
     
     conn.close()
         
-# Extracting data from JSON file and Storing in MySQL
-def extract_data(filepaths):
-    conn = db_connection()
-    rows_check = []
+# Ingestion settings, the [ingestion] section
+def ingestion_config():
+    return section_config('ingestion', {'workers': 1, 'chunksize': 64, 'batch_size': 5000, 'max_buffer_mb': 64,
+                                        'load_mode': 'executemany', 'json_decoder': 'auto'})
+
+# Pulse file layout: data/<category>/<kind>/[hover/]country/<country>/[state/<state>/]<year>/<quarter>.json
+PULSE_PATH = re.compile(r"(?:^|/)data/(?P<category>aggregated|map|top)/(?P<kind>transaction|user)/(?:hover/)?"
+                        r"country/(?P<country>[^/]+)/(?:state/(?P<state>[^/]+)/)?(?P<year>\d{4})/(?P<quarter>\d)\.json$")
+TABLE_PREFIXES = {('aggregated', 'transaction'): 'agg_trans', ('aggregated', 'user'): 'agg_user',
+                  ('map', 'transaction'): 'map_trans', ('map', 'user'): 'map_user',
+                  ('top', 'transaction'): 'top_trans', ('top', 'user'): 'top_user'}
+
+# A classified Pulse file; scope is country or state and table is the table its rows are loaded into
+PulseFile = namedtuple('PulseFile', 'category kind scope country state year quarter table')
+
+# Classifying a json file from its path in a single pass, None for the files that are not ingested
+def classify(file):
+    match = PULSE_PATH.search(str(file).replace("\\", "/"))
+    if match is None:
+        return None
+    category, kind, country, state = match.group('category', 'kind', 'country', 'state')
+    scope = 'country' if state is None else 'state'
+    return PulseFile(category, kind, scope, country, state, int(match['year']), int(match['quarter']),
+                     f"{TABLE_PREFIXES[(category, kind)]}_{scope}")
+
+# Pulse spellings of the states that do not reduce to their GeoJSON name (ST_NM) by themselves
+# Keys are normalised by reference_key: lower case, dashes of the directory names read as spaces
+STATE_ALIASES = {'andaman & nicobar islands': 'Andaman & Nicobar',
+                 'andaman and nicobar islands': 'Andaman & Nicobar',
+                 'dadra & nagar haveli & daman & diu': 'Dadra and Nagar Haveli and Daman and Diu',
+                 'dadra & nagar haveli': 'Dadra and Nagar Haveli and Daman and Diu',
+                 'daman & diu': 'Dadra and Nagar Haveli and Daman and Diu',
+                 'jammu and kashmir': 'Jammu & Kashmir',
+                 'nct of delhi': 'Delhi',
+                 'orissa': 'Odisha',
+                 'pondicherry': 'Puducherry'}
+
+# Normalised spelling of a raw state name, as found in the file contents or in the directory names
+def reference_key(name):
+    return " ".join(name.replace('-', ' ').lower().split())
+
+# Reference of the canonical state names: every known spelling to the ST_NM value of the state in the GeoJSON,
+# so the stored names match the map as they are. Stored in the ref_state table by create_mysqlschema
+# A parse worker is handed the reference of its parent (worker_reference) rather than reading the GeoJSON again
+worker_reference = None
+
+@lru_cache(maxsize=None)
+def state_reference():
+    if worker_reference is not None:
+        return worker_reference
+    reference = {reference_key(name): name for name in state_lookup(geo_config()['filename'])}
+    reference.update(STATE_ALIASES)
+    return reference
+
+# Canonical name of a state spelling, None when the reference does not know it
+@lru_cache(maxsize=None)
+def canonical_state(name):
+    return state_reference().get(reference_key(name))
+
+# Canonical name of a state, unmapped names are added to unmapped and kept title cased
+def state_name(name, unmapped):
+    canonical = canonical_state(name)
+    if canonical is None:
+        unmapped.add(reference_key(name))
+        return reference_key(name).title()
+    return canonical
+
+# Display name of a district, title cased once at load time
+@lru_cache(maxsize=4096)
+def district_name(name):
+    return " ".join(name.split()).title()
+
+# Names listed by a map file: the states for the country files, the districts for the state files
+def place_name(name, key, unmapped):
+    return state_name(name, unmapped) if len(key) == 3 else district_name(name)
+
+# Names listed by a top file by category, the pincodes are kept as they are
+def top_name(category, name, unmapped):
+    if category == 'states':
+        return state_name(name, unmapped)
+    return district_name(name) if category == 'districts' else name
+
+# Row extractors by (category, kind), each one turns the 'data' object of a file into rows
+# that start with the key of the file: (country, year, quarter) or (country, state, year, quarter)
+# State and district names are stored canonical, unmapped state names are collected in unmapped
+EXTRACTORS = {}
+
+# Registering the row extractor of a json schema
+def extractor(category, kind):
+    def register(function):
+        EXTRACTORS[(category, kind)] = function
+        return function
+    return register
+
+@extractor('aggregated', 'transaction')
+def aggregated_transaction(data, key, unmapped):
+    return [key + (i['name'], i['paymentInstruments'][0]['count'], i['paymentInstruments'][0]['amount'])
+            for i in data['transactionData']]
+
+@extractor('aggregated', 'user')
+def aggregated_user(data, key, unmapped):
+    return [key + (i['brand'], i['count'], i['percentage']) for i in data['usersByDevice'] or []]
+
+@extractor('map', 'transaction')
+def map_transaction(data, key, unmapped):
+    return [key + (place_name(i['name'], key, unmapped), i['metric'][0]['count'], i['metric'][0]['amount'])
+            for i in data['hoverDataList']]
+
+@extractor('map', 'user')
+def map_user(data, key, unmapped):
+    return [key + (place_name(name, key, unmapped), value['registeredUsers'], value['appOpens'])
+            for name, value in data['hoverData'].items()]
+
+@extractor('top', 'transaction')
+def top_transaction(data, key, unmapped):
+    return [key + (category, top_name(category, j['entityName'], unmapped), j['metric']['count'], j['metric']['amount'])
+            for category, entries in data.items() if entries for j in entries]
+
+@extractor('top', 'user')
+def top_user(data, key, unmapped):
+    return [key + (category, top_name(category, j['name'], unmapped), j['registeredUsers'])
+            for category, entries in data.items() if entries for j in entries]
+
+# JSON decoder by name: json, orjson, or auto (orjson when it is installed), resolved once per process
+@lru_cache(maxsize=None)
+def json_decoder(name='auto'):
+    if name in ('auto', 'orjson'):
+        try:
+            import orjson
+            return orjson.loads
+        except ImportError:
+            if name == 'orjson':
+                print("orjson is not installed, falling back to json")
+    return json.loads
+
+# Extracting the rows of a chunk of json files grouped by the target table, together with the time spent
+# classifying, reading, decoding and extracting and the state names missing from the reference (unmapped)
+# This is the unit of work handed to each worker process
+def parse_chunk(files, decoder='auto'):
+    decode = json_decoder(decoder)
+    tables = {}
+    unmapped = set()
+    timings = {'files': 0, 'bytes': 0, 'classify': 0.0, 'read': 0.0, 'decode': 0.0, 'extract': 0.0, 'unmapped': unmapped}
+    for file in files:
+        start = time.perf_counter()
+        record = classify(file)
+        classified = time.perf_counter()
+        timings['classify'] += classified - start
+        if record is None:
+            continue
+        with open(file, 'rb') as f:
+            content = f.read()
+        read = time.perf_counter()
+        data = decode(content)['data']
+        decoded = time.perf_counter()
+        key = (record.country, record.year, record.quarter) if record.state is None \
+            else (record.country, state_name(record.state, unmapped), record.year, record.quarter)
+        rows = EXTRACTORS[(record.category, record.kind)](data, key, unmapped)
+        if rows:
+            tables.setdefault(record.table, []).extend(rows)
+        extracted = time.perf_counter()
+        timings['files'] += 1
+        timings['bytes'] += len(content)
+        timings['read'] += read - classified
+        timings['decode'] += decoded - read
+        timings['extract'] += extracted - decoded
+    return tables, timings
+
+# Initializer of the parse workers, setting the reference of the canonical state names built by the parent
+def init_parse_worker(reference):
+    global worker_reference
+    worker_reference = reference
+
+# Parsing all the json files, either serially or spread across a pool of worker processes
+# Chunks are returned in the order of the filepaths, so both paths produce identical rows
+# At most two chunks per worker are in flight, so parsed rows never pile up ahead of the inserts
+# The state reference is built before the first chunk, so its load is not charged to the timings of the files
+def parse_files(filepaths, workers=1, chunksize=64, decoder='auto'):
+    chunks = (filepaths[i:i+chunksize] for i in range(0, len(filepaths), chunksize))
+    reference = state_reference()
+    if workers > 1 and len(filepaths) > chunksize:
+        # The workers are spawned, not forked: the refresh runs in a thread of the multi-threaded dashboard server,
+        # and a forked child could inherit a lock (the import lock, a logging handler) held by another thread
+        with get_context('spawn').Pool(processes=workers, initializer=init_parse_worker, initargs=(reference,)) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(parse_chunk, (chunk, decoder)))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+    else:
+        yield from (parse_chunk(chunk, decoder) for chunk in chunks)
+
+# Approximate memory held by a parsed row
+def row_size(row):
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+
+# Grouping the parsed rows into insert batches of a fixed size per table
+# When the buffered rows of all the tables exceed the memory ceiling, the largest buffer is flushed early
+def insert_batches(chunks, batch_size, max_buffer_bytes):
+    buffers = {table: [] for table in TABLES}
+    row_bytes = {table: 0 for table in TABLES}
+    buffered = 0
+    for chunk in chunks:
+        for table, rows in chunk.items():
+            if not rows:
+                continue
+            if not row_bytes[table]:
+                row_bytes[table] = row_size(rows[0])
+            buffers[table].extend(rows)
+            buffered += len(rows) * row_bytes[table]
+            while len(buffers[table]) >= batch_size:
+                batch, buffers[table] = buffers[table][:batch_size], buffers[table][batch_size:]
+                buffered -= len(batch) * row_bytes[table]
+                yield table, batch
+        while buffered > max_buffer_bytes:
+            table = max(TABLES, key=lambda t: len(buffers[t]) * row_bytes[t])
+            batch, buffers[table] = buffers[table], []
+            buffered -= len(batch) * row_bytes[table]
+            yield table, batch
+    for table in TABLES:
+        if buffers[table]:
+            yield table, buffers[table]
+
+# Inserting the rows with multi-row INSERT statements, each one sized to fit within max_packet bytes
+def insert_multirow(cursor, table, rows, max_packet):
+    row_sql = "(" + placeholders(len(rows[0])) + ")"
+    start, size = 0, 0
+    for i, row in enumerate(rows):
+        row_len = sum(len(str(value)) + 3 for value in row) + 4
+        if i > start and size + row_len > max_packet:
+            cursor.execute(upsert_query(table, "VALUES " + ", ".join([row_sql] * (i - start))),
+                           [value for r in rows[start:i] for value in r])
+            start, size = i, 0
+        size += row_len
+    cursor.execute(upsert_query(table, "VALUES " + ", ".join([row_sql] * (len(rows) - start))),
+                   [value for r in rows[start:] for value in r])
+
+# Upserting the rows as a DataFrame that DuckDB scans in a single vectorized statement
+def insert_frame(cursor, table, columns, key, rows):
+    cursor.register('batch', pd.DataFrame.from_records(rows, columns=columns))
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("USE phonepe")
-            cursor.execute("SELECT * from agg_trans_country")
-            rows_check = cursor.fetchall()
-            
-    except Error as e:
-        print("Error : ",e)
-    conn.close()
+        cursor.execute(upsert_sql(table, columns, key, "SELECT * FROM batch"))
+    finally:
+        cursor.unregister('batch')
 
-    # Data Extraction from json and Storing to MySQL after checking that there is no data in the database table
-    # It's necessary to check to avoid inserting duplicate records
-    if not rows_check:
-        aggr_trans, aggr_user = [], []
-        map_trans, map_user = [], []
-        top_trans, top_user = [], []
-        agg_trans_country, agg_trans_state = [], []
-        agg_user_country, agg_user_state = [], []
-        map_trans_country, map_trans_state = [], []
-        map_user_country, map_user_state = [], []
-        top_trans_country, top_trans_state = [], []
-        top_user_country, top_user_state = [], []
-        state = ""
-        for file in filepaths:
-            path = pathlib.PurePath(file)
-            #print("parent: ",path.parent)
-            #print("parent name: ",path.parent.name)        
-            #print(file)
-            if Path(rf"{path}").parts[2]=='aggregated' and Path(rf"{path}").parts[3]=='transaction':
-                aggr_trans.append(file) 
-                jsonfile = json.load(open(file))    
-                country, year, quarter = Path(rf"{path}").parts[5], Path(rf"{path}").parts[-2], (Path(rf"{path}").parts[-1]).strip('.json')
-                #state = ""
-                if Path(rf"{path}").parts[6]=='state':
-                    state = Path(rf"{path}").parts[7]
-                for i in jsonfile['data']['transactionData']:
-                    if Path(rf"{path}").parts[6]=='state':
-                        agg_trans_state.append((country, state, year, quarter, i['name'], i['paymentInstruments'][0]['count'], i['paymentInstruments'][0]['amount']))    
-                    else:
-                        agg_trans_country.append((country, year, quarter, i['name'], i['paymentInstruments'][0]['count'], i['paymentInstruments'][0]['amount']))
-
-            elif Path(rf"{path}").parts[2]=='aggregated' and Path(rf"{path}").parts[3]=='user':
-                aggr_user.append(file)
-                jsonfile = json.load(open(file))    
-                country, year, quarter = Path(rf"{path}").parts[5], Path(rf"{path}").parts[-2], (Path(rf"{path}").parts[-1]).strip('.json')
-                #state = ""
-                if Path(rf"{path}").parts[6]=='state':
-                    state = Path(rf"{path}").parts[7]
-                if jsonfile['data']['usersByDevice']: # Checking for Not Null
-                    for i in jsonfile['data']['usersByDevice']:
-                        if Path(rf"{path}").parts[6]=='state':
-                            agg_user_state.append((country, state, year, quarter, i['brand'], i['count'], i['percentage']))    
-                        else:
-                            agg_user_country.append((country, year, quarter, i['brand'], i['count'], i['percentage']))
-
-            elif Path(rf"{path}").parts[2]=='map' and Path(rf"{path}").parts[3]=='transaction':
-                map_trans.append(file)     
-                jsonfile = json.load(open(file))    
-                country, year, quarter = Path(rf"{path}").parts[6], Path(rf"{path}").parts[-2], (Path(rf"{path}").parts[-1]).strip('.json')
-                #state = ""
-                if Path(rf"{path}").parts[7]=='state':
-                    state = Path(rf"{path}").parts[8]
-                for i in jsonfile['data']['hoverDataList']:
-                    if Path(rf"{path}").parts[7]=='state':
-                        map_trans_state.append((country, state, year, quarter, i['name'], i['metric'][0]['count'], i['metric'][0]['amount']))    
-                    else:
-                        map_trans_country.append((country, year, quarter, i['name'], i['metric'][0]['count'], i['metric'][0]['amount']))
-
-            elif Path(rf"{path}").parts[2]=='map' and Path(rf"{path}").parts[3]=='user':
-                map_user.append(file)
-                jsonfile = json.load(open(file))    
-                country, year, quarter = Path(rf"{path}").parts[6], Path(rf"{path}").parts[-2], (Path(rf"{path}").parts[-1]).strip('.json')
-                #state = ""
-                if Path(rf"{path}").parts[7]=='state':
-                    state = Path(rf"{path}").parts[8]
-                for i in jsonfile['data']['hoverData']:
-                    if Path(rf"{path}").parts[7]=='state':
-                        map_user_state.append((country, state, year, quarter, i, jsonfile['data']['hoverData'][i]['registeredUsers'], jsonfile['data']['hoverData'][i]['appOpens']))    
-                    else:
-                        map_user_country.append((country, year, quarter, i, jsonfile['data']['hoverData'][i]['registeredUsers'], jsonfile['data']['hoverData'][i]['appOpens']))
-
-            elif Path(rf"{path}").parts[2]=='top' and Path(rf"{path}").parts[3]=='transaction':
-                top_trans.append(file)     
-                jsonfile = json.load(open(file))    
-                country, year, quarter = Path(rf"{path}").parts[5], Path(rf"{path}").parts[-2], (Path(rf"{path}").parts[-1]).strip('.json')
-                #state = ""
-                if Path(rf"{path}").parts[6]=='state':
-                    state = Path(rf"{path}").parts[7]
-                for i in jsonfile['data']:
-                    if jsonfile['data'][i]:
-                        for j in jsonfile['data'][i]:
-                            if Path(rf"{path}").parts[6]=='state':
-                                top_trans_state.append((country, state, year, quarter, i, j['entityName'], j['metric']['count'], j['metric']['amount']))
-                            else:
-                                top_trans_country.append((country, year, quarter, i, j['entityName'], j['metric']['count'], j['metric']['amount']))
-
-            elif Path(rf"{path}").parts[2]=='top' and Path(rf"{path}").parts[3]=='user':
-                top_user.append(file)
-                jsonfile = json.load(open(file))    
-                country, year, quarter = Path(rf"{path}").parts[5], Path(rf"{path}").parts[-2], (Path(rf"{path}").parts[-1]).strip('.json')
-                #state = ""
-                if Path(rf"{path}").parts[6]=='state':
-                    state = Path(rf"{path}").parts[7]
-                for i in jsonfile['data']:
-                    if jsonfile['data'][i]:
-                        for j in jsonfile['data'][i]:
-                            if Path(rf"{path}").parts[6]=='state':
-                                top_user_state.append((country, state, year, quarter, i, j['name'], j['registeredUsers']))
-                            else:
-                                top_user_country.append((country, year, quarter, i, j['name'], j['registeredUsers']))
-            
-        #print("Aggregated: ",len(aggr_trans))
-        #print(len(aggr_trans),len(aggr_user), len(map_trans), len(map_user), len(top_trans), len(top_user))
-        #print(top_user_country)
-        print(len(agg_trans_country), len(agg_trans_state), len(agg_user_country), len(agg_user_state))
-        print(len(map_trans_country), len(map_trans_state), len(map_user_country), len(map_user_state))
-        print(len(top_trans_country), len(top_trans_state), len(top_user_country), len(top_user_state))
-        
-        # Storing the data into MySQL
-        conn = db_connection()
+# Upserting rows with executemany, or as a frame on DuckDB, whose executemany runs one statement per row
+def upsert_rows(cursor, table, columns, key, rows):
+    if not rows:
+        return
+    if backend() == 'duckdb':
+        insert_frame(cursor, table, columns, key, rows)
+    else:
+        cursor.executemany(upsert_sql(table, columns, key, f"VALUES({placeholders(len(columns))})"), rows)
+
+# Upserting one batch and committing it, multi-row and frame statements fall back to executemany on failure
+def insert_batch(conn, cursor, table, rows, mode, max_packet):
+    if mode in ('multirow', 'frame'):
         try:
-            with conn.cursor() as cursor:
-                cursor.execute("USE phonepe")                
-                cursor.executemany("INSERT INTO agg_trans_country VALUES(%s, %s, %s, %s, %s, %s)", agg_trans_country)
-                cursor.executemany("INSERT INTO agg_trans_state VALUES(%s, %s, %s, %s, %s, %s, %s)", agg_trans_state)
-                cursor.executemany("INSERT INTO agg_user_country VALUES(%s, %s, %s, %s, %s, %s)", agg_user_country)
-                cursor.executemany("INSERT INTO agg_user_state VALUES(%s, %s, %s, %s, %s, %s, %s)", agg_user_state)
-                cursor.executemany("INSERT INTO map_trans_country VALUES(%s, %s, %s, %s, %s, %s)", map_trans_country)
-                cursor.executemany("INSERT INTO map_trans_state VALUES(%s, %s, %s, %s, %s, %s, %s)", map_trans_state)
-                cursor.executemany("INSERT INTO map_user_country VALUES(%s, %s, %s, %s, %s, %s)", map_user_country)
-                cursor.executemany("INSERT INTO map_user_state VALUES(%s, %s, %s, %s, %s, %s, %s)", map_user_state)
-                cursor.executemany("INSERT INTO top_trans_country VALUES(%s, %s, %s, %s, %s, %s, %s)", top_trans_country)
-                cursor.executemany("INSERT INTO top_trans_state VALUES(%s, %s, %s, %s, %s, %s, %s, %s)", top_trans_state)
-                cursor.executemany("INSERT INTO top_user_country VALUES(%s, %s, %s, %s, %s, %s)", top_user_country)
-                cursor.executemany("INSERT INTO top_user_state VALUES(%s, %s, %s, %s, %s, %s, %s)", top_user_state)
-                conn.commit()   
+            if mode == 'frame':
+                insert_frame(cursor, table, [column for column, sqltype in SCHEMA[table]['columns']], SCHEMA[table]['key'], rows)
+            else:
+                insert_multirow(cursor, table, rows, max_packet)
+            conn.commit()
+            return
         except Error as e:
-            print("Error during data insertion: ",e)
-        conn.close()
+            conn.rollback()
+            print(f"{'Frame' if mode == 'frame' else 'Multi-row'} insert into {table} failed, retrying with executemany: ",e)
+    cursor.executemany(upsert_query(table, f"VALUES ({placeholders(len(rows[0]))})"), rows)
+    conn.commit()
 
-def execute_github_data_extraction():
-    clone() 
-    create_mysqlschema()
-    filepaths = read_dir()
-    extract_data(filepaths)
-    return 1
+# Formatting a value for a staging file in the default LOAD DATA format (tab separated, backslash escaped)
+def tsv_value(value):
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
 
+# Reading the rows of a staging file back, in batches
+def read_staged(filename, batch_size):
+    unescape = lambda m: {'t': '\t', 'n': '\n', 'N': None}.get(m.group(1), m.group(1))
+    batch = []
+    with open(filename, encoding='utf-8', newline='\n') as f:
+        for line in f:
+            batch.append(tuple(None if value == "\\N" else re.sub(r"\\(.)", unescape, value)
+                               for value in line.rstrip('\n').split('\t')))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+# Resolving the load mode, 'auto' picks LOAD DATA LOCAL INFILE when the server allows it
+# and multi-row INSERT statements otherwise
+# The embedded backends have no LOAD DATA: DuckDB loads frames (auto and infile), SQLite runs executemany in process
+# frame needs DuckDB, the other backends load with multi-row statements instead
+def resolve_load_mode(conn, mode):
+    if mode == 'frame' and backend() != 'duckdb':
+        print(f"The frame load mode needs the duckdb backend, loading with multirow on {backend()}")
+        mode = 'multirow'
+    if backend() != 'mysql':
+        if mode in ('auto', 'infile'):
+            return 'frame' if backend() == 'duckdb' else 'executemany'
+        return mode
+    if mode != 'auto':
+        return mode
+    try:
+        with closing(conn.cursor()) as cursor:
+            cursor.execute("SELECT @@local_infile")
+            if cursor.fetchone()[0]:
+                return 'infile'
+    except Error as e:
+        print("Error while checking local_infile: ",e)
+    return 'multirow'
 
+# Loading the batches into the tables and returning the inserted rows, the time spent and the failed rows per table
+# executemany / multirow / frame (DuckDB): each batch is inserted and committed on its own, so a bad row only loses its own batch
+# infile: the batches of each table are streamed into a staging file that is loaded with LOAD DATA LOCAL INFILE,
+# a table whose load fails is inserted again from its staging file with multi-row statements
+def load_batches(conn, batches, mode='executemany', batch_size=5000):
+    stats = {table: [0, 0.0, 0] for table in TABLES}
+    staging, staged = {}, {table: 0 for table in TABLES}
+    with closing(conn.cursor()) as cursor:
+        # Embedded backends have no packet limit, their statements are kept small enough for SQLite's parameter limit
+        max_packet = 2**18
+        if backend() == 'mysql':
+            cursor.execute("SELECT @@max_allowed_packet")
+            max_packet = int(cursor.fetchone()[0] * 0.9)
+        for table, rows in batches:
+            count('phonepe_ingest_bytes_total', len(rows) * row_size(rows[0]), table=table)
+            start = time.perf_counter()
+            if mode == 'infile':
+                if table not in staging:
+                    staging[table] = tempfile.NamedTemporaryFile('w', suffix=f'_{table}.tsv', delete=False,
+                                                                 encoding='utf-8', newline='\n')
+                staging[table].writelines("\t".join(tsv_value(value) for value in row) + "\n" for row in rows)
+                staged[table] += len(rows)
+            else:
+                try:
+                    insert_batch(conn, cursor, table, rows, mode, max_packet)
+                    stats[table][0] += len(rows)
+                except Error as e:
+                    conn.rollback()
+                    stats[table][2] += len(rows)
+                    print(f"Error during data insertion into {table}: ",e)
+            stats[table][1] += time.perf_counter() - start
+
+        for table, staging_file in staging.items():
+            staging_file.close()
+            start = time.perf_counter()
+            try:
+                cursor.execute(f"LOAD DATA LOCAL INFILE '{Path(staging_file.name).as_posix()}' "
+                               f"REPLACE INTO TABLE {table} CHARACTER SET utf8mb4")
+                conn.commit()
+                stats[table][0] += staged[table]
+            except Error as e:
+                conn.rollback()
+                print(f"LOAD DATA into {table} failed, falling back to multi-row inserts: ",e)
+                for rows in read_staged(staging_file.name, batch_size):
+                    try:
+                        insert_batch(conn, cursor, table, rows, 'multirow', max_packet)
+                        stats[table][0] += len(rows)
+                    except Error as e:
+                        conn.rollback()
+                        stats[table][2] += len(rows)
+                        print(f"Error during data insertion into {table}: ",e)
+            os.remove(staging_file.name)
+            stats[table][1] += time.perf_counter() - start
+    return stats
+
+# Locating the table and the (country, state, year, quarter) slice that a json file is loaded into
+# state is None for the country level files, None is returned for files that are not ingested
+def file_scope(file):
+    record = classify(file)
+    if record is None:
+        return None
+    state = record.state and state_name(record.state, set())
+    return record.table, record.country, state, record.year, record.quarter
+
+# Hashing the content of a json file
+def file_hash(file):
+    with open(file, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+# Reading the manifest of the already ingested files
+def read_manifest(cursor):
+    cursor.execute("SELECT path, size, mtime, hash FROM ingest_manifest")
+    return {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+
+# Comparing the files on disk with the manifest
+# Content is hashed only when the size or the modification time differs from the manifest
+def diff_manifest(filepaths, manifest):
+    changed, entries, seen = [], [], set()
+    for file in filepaths:
+        key = Path(file).as_posix()
+        seen.add(key)
+        stat = os.stat(file)
+        known = manifest.get(key)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime:
+            continue
+        digest = file_hash(file)
+        if not known or known[2] != digest:
+            changed.append(file)
+        entries.append((key, stat.st_size, stat.st_mtime, digest))
+    removed = [key for key in manifest if key not in seen]
+    return changed, removed, entries
+
+# Slices of the tables covered by the given files, as (table, columns, values): the rows of a country file share
+# its country, year and quarter, the rows of a state file also its state
+# With the star schema the names of the slices are looked up in dimensions, a name that is not there has no rows
+def file_slices(files, dimensions=None):
+    slices = set()
+    for scope in {file_scope(file) for file in files} - {None}:
+        table, country, state, year, quarter = scope
+        if dimensions is not None:
+            country = dimensions['dim_country'].get(country.lower())
+            state = state and dimensions['dim_state'].get(state.lower(), 0)
+            if country is None:
+                continue
+        if state is None:
+            slices.add((table, ('country', 'year', 'quarter'), (country, year, quarter)))
+        else:
+            slices.add((table, ('country', 'state', 'year', 'quarter'), (country, state, year, quarter)))
+    return slices
+
+# Values compared case-insensitively, like the keys of the backends
+def folded(values):
+    return tuple(value.lower() if isinstance(value, str) else value for value in values)
+
+# Passing the batches through and collecting in loaded the keys of the rows that fall into the given slices,
+# by (table, values of the slice)
+def loaded_keys(batches, slices, loaded):
+    columns = {table: slice_columns for table, slice_columns, values in slices}
+    wanted = {(table, folded(values)) for table, slice_columns, values in slices}
+    for table, rows in batches:
+        if table in columns:
+            names = [column for column, sqltype in SCHEMA[table]['columns']]
+            slice_positions = [names.index(column) for column in columns[table]]
+            key_positions = [names.index(column) for column in SCHEMA[table]['key']]
+            for row in rows:
+                values = (table, folded(row[i] for i in slice_positions))
+                if values in wanted:
+                    loaded.setdefault(values, set()).add(folded(row[i] for i in key_positions))
+        yield table, rows
+
+# Deleting the rows of the given slices that the load did not write again: every row of a removed file, and the
+# rows a changed file no longer lists. The other rows of a changed file were replaced in place by the upserts
+def delete_stale_rows(cursor, slices, loaded):
+    mark = placeholders()
+    for table, columns, values in slices:
+        condition = " AND ".join(f"{column}={mark}" for column in columns)
+        keys = loaded.get((table, folded(values)))
+        if not keys:
+            cursor.execute(f"DELETE FROM {table} WHERE {condition}", values)
+            continue
+        key = SCHEMA[table]['key']
+        cursor.execute(f"SELECT {', '.join(key)} FROM {table} WHERE {condition}", values)
+        stale = [row for row in cursor.fetchall() if folded(row) not in keys]
+        if stale:
+            cursor.executemany(f"DELETE FROM {table} WHERE " + " AND ".join(f"{column}={mark}" for column in key), stale)
+
+# Passing the rows of the parsed chunks through, adding up the parse timings
+# and reporting the fraction of the files parsed when progress is given
+def parsed_rows(results, chunksize, total, timings, progress=None):
+    for i, (tables, chunk_timings) in enumerate(results, 1):
+        for stage, value in chunk_timings.items():
+            if stage == 'unmapped':
+                timings.setdefault(stage, set()).update(value)
+            else:
+                timings[stage] = timings.get(stage, 0) + value
+        if progress:
+            progress(min(i * chunksize, total) / max(total, 1))
+        yield tables
+
+# Extracting data from JSON file and Storing in MySQL
+# Only the files that are new or changed since the last run are parsed. The parsed rows are streamed into the
+# tables batch by batch, the rows of a changed file replace the ones loaded before in place (upserts), so the
+# readers never miss a slice. The rows the changed files no longer list and the rows of the removed files are
+# deleted in the last transaction, together with the rollups, the data versions and the manifest. The manifest
+# skips tables with failed batches, and their stale rows are kept, so an interrupted run is picked up by the next one
+# The rollups of the touched years, the trends of the touched tables and the data versions are refreshed together with the manifest
+# load_mode is one of executemany, multirow, infile or auto (see load_batches)
+# progress, when given, is called with the fraction of the changed files parsed so far
+def extract_data(filepaths, workers=None, chunksize=None, batch_size=None, load_mode=None, progress=None):
+    settings = ingestion_config()
+    workers = workers or settings['workers']
+    chunksize = chunksize or settings['chunksize']
+    batch_size = batch_size or settings['batch_size']
+    load_mode = load_mode or settings['load_mode']
+    if workers <= 0:
+        workers = cpu_count()
+    filepaths = list(filepaths)
+
+    conn = db_connection(allow_local_infile=load_mode in ('auto', 'infile'))
+    try:
+        load_mode = resolve_load_mode(conn, load_mode)
+        dimensions, extended = None, {}
+        with closing(conn.cursor()) as cursor:
+            manifest = read_manifest(cursor)
+            changed, removed, entries = diff_manifest(filepaths, manifest)
+            print(f"Files new/changed: {len(changed)}, removed: {len(removed)}, unchanged: {len(filepaths) - len(changed)}")
+            if star_schema():
+                dimensions = read_dimensions(cursor)
+        # Slices loaded before that get rows again: the slices of the changed files already in the manifest and the
+        # slices of the removed files that a new file covers (a renamed file). The other slices of the removed files
+        # are dropped
+        dropped = file_slices(removed, dimensions)
+        replaced = file_slices([file for file in changed if Path(file).as_posix() in manifest], dimensions) \
+            | (dropped & file_slices(changed, dimensions) if dropped else set())
+        dropped -= replaced
+        loaded = {}
+
+        # Storing the data into MySQL
+        timings = {}
+        chunks = parsed_rows(parse_files(changed, workers, chunksize, settings['json_decoder']),
+                             chunksize, len(changed), timings, progress)
+        batches = insert_batches(chunks, batch_size, settings['max_buffer_mb'] * 2**20)
+        if dimensions is not None:
+            batches = encode_batches(conn, batches, dimensions, extended)
+        stats = load_batches(conn, loaded_keys(batches, replaced, loaded), load_mode, batch_size)
+        if timings.get('files'):
+            per_file = {stage: timings[stage] / timings['files'] * 10**6 for stage in ('classify', 'read', 'decode', 'extract')}
+            print(f"Parsed {timings['files']} files ({json_decoder(settings['json_decoder']).__module__}), per file: "
+                  + ", ".join(f"{stage} {value:.0f}us" for stage, value in per_file.items()))
+            count('phonepe_parsed_files_total', timings['files'])
+            count('phonepe_parsed_bytes_total', timings['bytes'])
+            for stage in ('classify', 'read', 'decode', 'extract'):
+                count('phonepe_parse_seconds_total', timings[stage], step=stage)
+        if timings.get('unmapped'):
+            # Unmapped states are loaded under their title cased name, which the map does not show
+            unmapped = sorted(timings['unmapped'])
+            print(f"State names missing from the reference ({len(unmapped)}), add them to STATE_ALIASES: "
+                  + ", ".join(unmapped[:20]) + (", ..." if len(unmapped) > 20 else ""))
+            count('phonepe_unmapped_states_total', len(unmapped))
+        for table, (rows, seconds, failed) in stats.items():
+            count('phonepe_ingest_rows_total', rows, table=table)
+            count('phonepe_ingest_failed_rows_total', failed, table=table)
+            count('phonepe_insert_seconds_total', seconds, table=table, mode=load_mode)
+            if rows or failed:
+                print(f"{table} ({load_mode}): {rows} rows in {seconds:.2f}s ({rows / max(seconds, 1e-9):.0f} rows/s), {failed} failed")
+
+        failed = {table for table, (rows, seconds, failed) in stats.items() if failed}
+        entries = [entry for entry in entries if (file_scope(entry[0]) or [None])[0] not in failed]
+        with closing(conn.cursor()) as cursor:
+            delete_stale_rows(cursor, [slice for slice in replaced if slice[0] not in failed] + list(dropped), loaded)
+            scopes = {file_scope(file) for file in changed + removed} - {None}
+            tables = {scope[0] for scope in scopes}
+            touched = tables | set(refresh_rollups(cursor, scopes)) | set(refresh_trends(cursor, tables)) | set(extended)
+            if touched:
+                print(f"Data version {bump_versions(cursor, sorted(touched))}: {', '.join(sorted(touched))}")
+            upsert_rows(cursor, 'ingest_manifest', ['path', 'size', 'mtime', 'hash'], ['path'], entries)
+            if removed:
+                cursor.executemany(f"DELETE FROM ingest_manifest WHERE path={placeholders()}", [(key,) for key in removed])
+            conn.commit()
+    except Error as e:
+        print("Error during data insertion: ",e)
+    conn.close()
+
+# Writing the columnar snapshot of the current data version with the simplified state geometry of the [geo]
+# settings, unless it is already written. Returns the current data version
+def export_snapshot():
+    settings = geo_config()
+    conn = db_connection()
+    version = None
+    try:
+        with closing(conn.cursor()) as cursor:
+            version = current_version(cursor)
+            geometry = {geometry_name(settings['tolerance'], settings['precision']):
+                        india_geometry(settings['filename'], settings['tolerance'], settings['precision'])}
+            write_snapshot(cursor, TABLES + list(ROLLUPS) + list(TRENDS) + list(DIMENSION_TABLES) + ['data_version'], version,
+                           documents=geometry)
+    except Error as e:
+        print("Error during snapshot export: ",e)
+    conn.close()
+    return version
 
+# Running the whole refresh and returning the resulting data version
+# progress, when given, is called with the name of the running stage and the fraction of the refresh done
+def execute_github_data_extraction(progress=None):
+    progress = progress or (lambda stage, fraction: None)
+    progress('clone', 0.0)
+    with timer('phonepe_stage_seconds', stage='clone'):
+        clone() 
+    progress('schema', 0.05)
+    with timer('phonepe_stage_seconds', stage='schema'):
+        create_mysqlschema()
+    progress('read_dir', 0.1)
+    with timer('phonepe_stage_seconds', stage='read_dir'):
+        filepaths = read_dir()
+    count('phonepe_files_total', len(filepaths))
+    progress('extract', 0.15)
+    with timer('phonepe_stage_seconds', stage='extract'):
+        extract_data(filepaths, progress=lambda fraction: progress('extract', 0.15 + 0.75 * fraction))
+    progress('snapshot', 0.9)
+    with timer('phonepe_stage_seconds', stage='snapshot'):
+        version = export_snapshot()
+    progress('done', 1.0)
+    write_metrics(force=True)
+    return version
 
+# python PhonePe_Data.py runs one refresh and publishes its snapshot, the loader of dashboards in snapshot mode
+if __name__ == "__main__":
+    execute_github_data_extraction()
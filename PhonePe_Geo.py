@@ -0,0 +1,141 @@
+import json
+import time
+from functools import lru_cache
+from PhonePe_DB import section_config
+
+# Geometry settings, the [geo] section
+# tolerance: simplification tolerance in degrees (0 keeps every vertex), precision: decimals kept per coordinate
+def geo_config():
+    return section_config('geo', {'filename': 'india_states.geojson', 'tolerance': 0.02, 'precision': 3})
+
+# Parsing the GeoJSON once per process
+@lru_cache(maxsize=None)
+def load_geojson(filename='india_states.geojson'):
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+# Lookup of the state names (ST_NM) to the index of their feature
+@lru_cache(maxsize=None)
+def state_lookup(filename='india_states.geojson'):
+    return {feature['properties']['ST_NM']: index for index, feature in enumerate(load_geojson(filename)['features'])}
+
+# Rings (lists of (lon, lat) tuples) of a Polygon or MultiPolygon geometry, as a list of polygons
+def geometry_polygons(geometry):
+    polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+    return [[[tuple(point[:2]) for point in ring] for ring in polygon] for polygon in polygons]
+
+# Rounding the coordinates of a closed ring and removing the repeated points this creates
+# Rings too small to survive the rounding (tiny islands) keep their original coordinates
+def quantize_ring(ring, precision):
+    quantized = []
+    for lon, lat in ring:
+        point = (round(lon, precision), round(lat, precision))
+        if not quantized or quantized[-1] != point:
+            quantized.append(point)
+    if quantized[0] != quantized[-1]:
+        quantized.append(quantized[0])
+    return quantized if len(quantized) >= 4 else ring
+
+# Douglas-Peucker simplification of an open polyline, the end points are always kept
+def douglas_peucker(points, tolerance):
+    if len(points) < 3 or tolerance <= 0:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = points[first], points[last]
+        dx, dy = x2 - x1, y2 - y1
+        norm = (dx * dx + dy * dy) ** 0.5
+        index, distance = 0, 0.0
+        for i in range(first + 1, last):
+            x, y = points[i]
+            if norm:
+                d = abs(dy * (x - x1) - dx * (y - y1)) / norm
+            else:
+                d = ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+            if d > distance:
+                index, distance = i, d
+        if distance > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+# Simplifying an arc once, whichever direction it is walked in, so borders shared by two states stay identical
+def simplify_arc(arc, tolerance, cache):
+    arc = tuple(arc)
+    reverse = arc[::-1]
+    key = min(arc, reverse)
+    if key not in cache:
+        cache[key] = douglas_peucker(key, tolerance)
+    return cache[key] if key == arc else cache[key][::-1]
+
+# Topology preserving simplification of all the rings
+# Rings are split into arcs at the junctions, the points where the neighbouring points differ between the rings
+# sharing them. Each arc is simplified once and reused by every ring that contains it, so no gaps or overlaps open
+# up between neighbouring states. A ring that would collapse keeps its quantized points.
+def simplify_rings(rings, tolerance):
+    neighbours = {}
+    for ring in rings:
+        points = ring[:-1]
+        for i, point in enumerate(points):
+            pair = frozenset((points[i - 1], points[(i + 1) % len(points)]))
+            neighbours.setdefault(point, set()).add(pair)
+    cache = {}
+    simplified = []
+    for ring in rings:
+        points = ring[:-1]
+        junctions = [i for i, point in enumerate(points) if len(neighbours[point]) > 1]
+        if not junctions:
+            # Closed ring without junctions: start from its smallest point in a fixed direction,
+            # so a ring shared as a whole (an enclave) is simplified identically on both sides
+            start = points.index(min(points))
+            forward = points[start:] + points[:start]
+            backward = [forward[0]] + forward[:0:-1]
+            canonical = min(forward, backward)
+            result = simplify_arc(canonical + [canonical[0]], tolerance, cache)
+            if canonical is backward:
+                result = result[::-1]
+        else:
+            start = junctions[0]
+            rotated = points[start:] + points[:start]
+            cuts = [i - start for i in junctions] + [len(points)]
+            rotated.append(rotated[0])
+            result = [rotated[0]]
+            for first, last in zip(cuts, cuts[1:]):
+                result += simplify_arc(rotated[first:last + 1], tolerance, cache)[1:]
+        simplified.append(result if len(result) >= 4 else ring)
+    return simplified
+
+# Simplified, quantized copy of the state GeoJSON, computed once per process for each setting
+# Every feature carries its ST_NM as the feature id, so the choropleth matches locations without a property lookup
+@lru_cache(maxsize=None)
+def india_geometry(filename='india_states.geojson', tolerance=0.02, precision=3):
+    features = load_geojson(filename)['features']
+    polygons = [geometry_polygons(feature['geometry']) for feature in features]
+    rings = [quantize_ring(ring, precision) for feature in polygons for polygon in feature for ring in polygon]
+    rings = iter(simplify_rings(rings, tolerance))
+    collection = {'type': 'FeatureCollection', 'features': []}
+    for feature, feature_polygons in zip(features, polygons):
+        coordinates = [[[list(point) for point in next(rings)] for ring in polygon] for polygon in feature_polygons]
+        collection['features'].append({
+            'type': 'Feature',
+            'id': feature['properties']['ST_NM'],
+            'properties': {'ST_NM': feature['properties']['ST_NM']},
+            'geometry': {'type': 'MultiPolygon', 'coordinates': coordinates}})
+    return collection
+
+# Printing the size of the simplified geometry for a few tolerances
+if __name__ == "__main__":
+    settings = geo_config()
+    original = len(json.dumps(load_geojson(settings['filename'])))
+    print(f"original: {original / 2**20:.2f} MB")
+    for tolerance in (0, 0.005, 0.01, 0.02, 0.05):
+        start = time.perf_counter()
+        geometry = india_geometry(settings['filename'], tolerance, settings['precision'])
+        seconds = time.perf_counter() - start
+        size = len(json.dumps(geometry, separators=(',', ':')))
+        points = sum(len(ring) for feature in geometry['features'] for polygon in feature['geometry']['coordinates'] for ring in polygon)
+        print(f"tolerance {tolerance}: {size / 2**20:.2f} MB, {points} points, {size / original:.1%} of the original, built in {seconds:.2f}s")
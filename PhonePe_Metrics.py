@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from PhonePe_DB import section_config
+
+# Metrics settings, the [metrics] section
+# enabled: collect the metrics at all, when disabled every timer and counter is a no-op
+# format: prometheus (text exposition format written to path) or log (one json line per observation)
+# interval_seconds: shortest time between two writes of the file by the page renders
+def metrics_config():
+    return section_config('metrics', {'enabled': False, 'format': 'prometheus', 'path': 'metrics.prom',
+                                      'interval_seconds': 15})
+
+settings = metrics_config()
+enabled = settings['enabled']
+logger = logging.getLogger('phonepe.metrics')
+if enabled and settings['format'] == 'log' and not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+# Counters and gauges by (name, labels) and summaries of the timings by (name, labels) as [count, sum, max]
+counters = {}
+gauges = {}
+summaries = {}
+metrics_lock = threading.Lock()
+NOOP = nullcontext()
+
+# Labels as a hashable, ordered key
+def label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+# Adding to a counter
+def count(name, value=1, **labels):
+    if not enabled:
+        return
+    key = (name, label_key(labels))
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + value
+    if settings['format'] == 'log':
+        logger.info(json.dumps({'metric': name, 'value': value, **labels}))
+
+# Setting a gauge to its current value
+def gauge(name, value, **labels):
+    if not enabled:
+        return
+    with metrics_lock:
+        gauges[(name, label_key(labels))] = value
+
+# Recording a duration in seconds
+def observe(name, seconds, **labels):
+    if not enabled:
+        return
+    key = (name, label_key(labels))
+    with metrics_lock:
+        summary = summaries.setdefault(key, [0, 0.0, 0.0])
+        summary[0] += 1
+        summary[1] += seconds
+        summary[2] = max(summary[2], seconds)
+    if settings['format'] == 'log':
+        logger.info(json.dumps({'metric': name, 'seconds': round(seconds, 6), **labels}))
+
+# Context manager recording the duration of its body
+@contextmanager
+def timing(name, labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+# Timing the body of a with statement, a shared no-op context when the metrics are disabled
+def timer(name, **labels):
+    return timing(name, labels) if enabled else NOOP
+
+# Caching a function with the given cache decorator (st.cache_data), counting its requests and misses
+# A miss is a run of the function body, so the hits are the requests that did not reach it
+def metered_cache(cache):
+    def decorate(function):
+        if not enabled:
+            return cache(function)
+        @wraps(function)
+        def miss(*args, **kwargs):
+            count('phonepe_cache_misses_total', function=function.__name__)
+            return function(*args, **kwargs)
+        cached = cache(miss)
+        @wraps(function)
+        def request(*args, **kwargs):
+            count('phonepe_cache_requests_total', function=function.__name__)
+            return cached(*args, **kwargs)
+        request.clear = cached.clear
+        return request
+    return decorate
+
+# Formatting a sample line of the text exposition format
+def sample(name, labels, value):
+    if labels:
+        name += "{" + ",".join(f'{key}="' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+                               for key, text in labels) + "}"
+    return f"{name} {value:.6g}" if isinstance(value, float) else f"{name} {value}"
+
+# All the metrics of this process in the Prometheus text exposition format
+# The timings are exported as summaries (_count and _sum) with their maximum as a gauge (_max),
+# the cache hits are derived from the requests and misses, and the pool utilisation is added to the gauges
+def render():
+    from PhonePe_DB import pool_stats
+    with metrics_lock:
+        counter_items = sorted(counters.items())
+        gauge_items = sorted(gauges.items())
+        summary_items = sorted((key, list(value)) for key, value in summaries.items())
+    lines = []
+    families = {}
+    for (name, labels), value in counter_items:
+        families.setdefault((name, 'counter'), []).append(sample(name, labels, value))
+    requests = {labels: value for (name, labels), value in counter_items if name == 'phonepe_cache_requests_total'}
+    misses = {labels: value for (name, labels), value in counter_items if name == 'phonepe_cache_misses_total'}
+    for labels, value in requests.items():
+        families.setdefault(('phonepe_cache_hits_total', 'counter'), []).append(
+            sample('phonepe_cache_hits_total', labels, value - misses.get(labels, 0)))
+    for (name, labels), value in gauge_items:
+        families.setdefault((name, 'gauge'), []).append(sample(name, labels, value))
+    for (name, labels), (total, seconds, longest) in summary_items:
+        families.setdefault((name, 'summary'), []).extend(
+            [sample(f"{name}_count", labels, total), sample(f"{name}_sum", labels, seconds)])
+        families.setdefault((f"{name}_max", 'gauge'), []).append(sample(f"{name}_max", labels, longest))
+    for pool, stats in pool_stats().items():
+        for stat, value in stats.items():
+            families.setdefault((f"phonepe_pool_{stat}", 'gauge'), []).append(
+                sample(f"phonepe_pool_{stat}", (('pool', pool),), value))
+    for (name, kind), samples in families.items():
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+# Writing the metrics to the configured file (prometheus format), replacing it atomically
+# so a scraper or the node exporter textfile collector never reads a half written file
+# Every page render of every session asks for it, the file is written at most every interval_seconds unless
+# forced (the end of a refresh). The processes sharing the file each have a temporary file of their own
+written = {'at': None}
+written_lock = threading.Lock()
+
+def write_metrics(force=False):
+    if not enabled or settings['format'] != 'prometheus':
+        return
+    now = time.monotonic()
+    with written_lock:
+        if not force and written['at'] is not None and now - written['at'] < settings['interval_seconds']:
+            return
+        written['at'] = now
+    try:
+        temporary = f"{settings['path']}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(render())
+        os.replace(temporary, settings['path'])
+    except OSError as e:
+        print("Error during writing metrics: ",e)
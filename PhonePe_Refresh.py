@@ -0,0 +1,71 @@
+import threading
+import time
+import traceback
+from datetime import datetime
+from PhonePe_Data import execute_github_data_extraction
+from PhonePe_DB import refresh_lock, section_config
+
+# Status of the background refresh, shared by every session of this server process
+# state: starting, running, ready, failed, or elsewhere when another process was refreshing the database
+# version: data version after the last successful refresh
+status = {'state': 'starting', 'stage': '', 'progress': 0.0, 'version': None,
+          'last_refresh': None, 'last_error': None}
+status_lock = threading.Lock()
+refresher = None
+
+# Background refresh settings, the [refresh] section
+# interval_minutes: time between two refreshes, 0 refreshes only once when the server starts
+def refresh_config():
+    return section_config('refresh', {'interval_minutes': 360})
+
+# Updating the shared status
+def update_status(**changes):
+    with status_lock:
+        status.update(changes)
+
+# Copy of the shared status, safe to read from any session
+def refresh_status():
+    with status_lock:
+        return dict(status)
+
+# Running one refresh and publishing its progress, returns True when the data version changed
+# Every dashboard process starts a refresher, the refresh lock of the database lets only one of them refresh at a
+# time: concurrent ingests would assign conflicting ids to new names with the star schema. The others skip the
+# refresh and read the new data versions it writes
+def run_refresh():
+    try:
+        with refresh_lock() as acquired:
+            if not acquired:
+                print("Another process is refreshing the database, skipping this refresh")
+                update_status(state='elsewhere', stage='', progress=0.0)
+                return False
+            update_status(state='running', stage='clone', progress=0.0)
+            version = execute_github_data_extraction(lambda stage, fraction: update_status(stage=stage, progress=fraction))
+    except Exception as e:
+        traceback.print_exc()
+        update_status(state='failed', last_error=str(e))
+        return False
+    changed = version != refresh_status()['version']
+    update_status(state='ready', stage='', progress=1.0, version=version, last_error=None,
+                  last_refresh=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    return changed
+
+# Refreshing right away and then every interval, on_refresh is called after every refresh that changed the data
+def refresh_loop(interval, on_refresh):
+    while True:
+        if run_refresh() and on_refresh:
+            on_refresh()
+        if interval <= 0:
+            return
+        time.sleep(interval)
+
+# Starting the background refresher, only the first call in a process starts the thread
+def start_refresher(on_refresh=None, interval_minutes=None):
+    global refresher
+    with status_lock:
+        if refresher is None:
+            interval = refresh_config()['interval_minutes'] if interval_minutes is None else interval_minutes
+            refresher = threading.Thread(target=refresh_loop, args=(interval * 60, on_refresh),
+                                         name="pulse-refresher", daemon=True)
+            refresher.start()
+    return refresh_status()
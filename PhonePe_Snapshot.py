@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+import pandas as pd
+from PhonePe_DB import section_config
+
+# pyarrow is only needed for the columnar snapshot, ingestion and the dashboard work without it
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+# Dimension columns stored as dictionary encoded (categorical) columns, or as narrow integers when they hold
+# the ids of the star schema
+CATEGORICAL = ['country', 'state', 'distrct', 'district', 'transaction_type', 'brand_name', 'cat_type', 'type_name']
+# Narrow integer types for the period columns
+INTEGER_TYPES = {'year': 'int16', 'quarter': 'int8'}
+
+# Snapshot settings, the [snapshot] section
+# shared: the directory is the data plane of several dashboard processes of the host (a tmpfs such as /dev/shm),
+# the processes reading it in snapshot mode keep no private copies of the data
+def snapshot_config():
+    return section_config('snapshot', {'directory': 'snapshot', 'keep': 2, 'shared': False})
+
+# Converting the rows of a table into a typed DataFrame
+def typed_frame(rows, columns):
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    for column in df.columns:
+        if column in CATEGORICAL and pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+        elif column in CATEGORICAL:
+            df[column] = df[column].astype('category')
+        elif column in INTEGER_TYPES:
+            df[column] = df[column].astype(INTEGER_TYPES[column])
+    return df
+
+# Name of the simplified state geometry published with a snapshot, one file per simplification setting
+def geometry_name(tolerance, precision):
+    return f"geometry-{tolerance}-{precision}.json"
+
+# Writing a snapshot of the given tables for a data version, one uncompressed Arrow IPC file per table,
+# and of the json documents by file name (the simplified geometry)
+# The snapshot is written into a temporary directory that is renamed into place, and the CURRENT pointer
+# is replaced atomically, so readers always see a complete snapshot
+def write_snapshot(cursor, tables, version, directory=None, documents=None):
+    settings = snapshot_config()
+    directory = directory or settings['directory']
+    if pa is None:
+        print("pyarrow is not installed, skipping the snapshot")
+        return None
+    path = os.path.join(directory, str(version))
+    if os.path.isdir(path):
+        return path
+    staging = os.path.join(directory, f".{version}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for table in tables:
+        cursor.execute(f"SELECT * FROM {table}")
+        columns = [column[0] for column in cursor.description]
+        df = typed_frame(cursor.fetchall(), columns)
+        feather.write_feather(df, os.path.join(staging, f"{table}.arrow"), compression='uncompressed')
+    for name, document in (documents or {}).items():
+        with open(os.path.join(staging, name), 'w') as f:
+            json.dump(document, f, separators=(',', ':'))
+    os.rename(staging, path)
+    with open(os.path.join(directory, 'CURRENT.tmp'), 'w') as f:
+        f.write(str(version))
+    os.replace(os.path.join(directory, 'CURRENT.tmp'), os.path.join(directory, 'CURRENT'))
+
+    # Removing the older snapshots
+    versions = sorted((int(name) for name in os.listdir(directory) if name.isdigit()), reverse=True)
+    for old in versions[settings['keep']:]:
+        shutil.rmtree(os.path.join(directory, str(old)), ignore_errors=True)
+    print(f"Snapshot of version {version} written to {path}")
+    return path
+
+# Locating the directory of the current snapshot, None when no snapshot was written yet
+def current_snapshot(directory=None):
+    directory = directory or snapshot_config()['directory']
+    try:
+        with open(os.path.join(directory, 'CURRENT')) as f:
+            path = os.path.join(directory, f.read().strip())
+    except OSError:
+        return None
+    return path if os.path.isdir(path) else None
+
+# Opening a table of a snapshot memory-mapped, its pages are shared through the OS page cache
+def open_table(path, table):
+    return feather.read_table(os.path.join(path, f"{table}.arrow"), memory_map=True)
+
+# Simplified state geometry published with a snapshot, None when it was written without it
+def read_geometry(path, tolerance, precision):
+    try:
+        with open(os.path.join(path, geometry_name(tolerance, precision))) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Checking whether a snapshot has a table, snapshots written by older versions lack the newer tables
+def has_table(path, table):
+    return os.path.isfile(os.path.join(path, f"{table}.arrow"))
+
+# Equality mask of a column against a value, string comparisons are case insensitive like the MySQL collation
+# Dictionary columns are compared on their (small) dictionary and the result is taken through the indices
+def column_equals(column, value):
+    if pa.types.is_dictionary(column.type):
+        return pa.chunked_array([pc.take(pc.equal(pc.utf8_lower(chunk.dictionary), str(value).lower()), chunk.indices)
+                                 for chunk in column.chunks], pa.bool_())
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        return pc.equal(pc.utf8_lower(column), str(value).lower())
+    return pc.equal(column, value)
+
+# Mask of the rows of the quarters from first to last, (first, last) as year * 4 + quarter, either None for an
+# open range
+def period_between(table, periods):
+    period = pc.add(pc.multiply(pc.cast(table['year'], pa.int32()), 4), pc.cast(table['quarter'], pa.int32()))
+    masks = [compare(period, value) for compare, value in zip((pc.greater_equal, pc.less_equal), periods) if value is not None]
+    return pc.and_(*masks) if len(masks) == 2 else masks[0] if masks else None
+
+# Selecting the given columns of an Arrow table filtered by equality on the keyword arguments and by periods,
+# the quarters from first to last like read_rows
+def filter_table(table, columns, periods=None, **filters):
+    mask = period_between(table, periods) if periods else None
+    for column, value in filters.items():
+        equals = column_equals(table[column], value)
+        mask = equals if mask is None else pc.and_(mask, equals)
+    if mask is not None:
+        table = table.filter(mask)
+    df = table.select(columns).to_pandas()
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].cat.remove_unused_categories()
+    return df
@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import random
+import time
+from PhonePe_Geo import geo_config, state_lookup
+
+TRANSACTION_TYPES = ['Recharge & bill payments', 'Peer-to-peer payments', 'Merchant payments', 'Financial Services', 'Others']
+BRANDS = ['Xiaomi', 'Samsung', 'Vivo', 'Oppo', 'OnePlus', 'Realme', 'Apple', 'Motorola', 'Lenovo', 'Huawei',
+          'Tecno', 'Gionee', 'Infinix', 'Asus', 'Micromax', 'HMD Global', 'Lava', 'COOLPAD', 'Lyf', 'Others']
+
+# Volume of the real Pulse repository, scale multiplies the number of states (and with it the files and rows)
+REAL_VOLUME = {'years': 6, 'states': 36, 'districts': 22, 'pincodes': 10}
+
+# Names of the synthetic states: the states of the GeoJSON (ST_NM) in name order, so the ingestion maps them to the
+# map as the real ones. Beyond the real number of states the names are repeated with a copy number, those states
+# only add volume: they are not on the map and are reported as missing from the reference by the ingestion
+def state_names(states):
+    names = sorted(state_lookup(geo_config()['filename']))
+    return [names[s % len(names)] + (f" {s // len(names) + 1}" if s >= len(names) else "") for s in range(states)]
+
+# Writing a json file in the layout of the Pulse repository, the response envelope included
+def write_json(root, parts, year, quarter, data):
+    directory = os.path.join(root, 'data', *parts, str(year))
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{quarter}.json"), 'w') as f:
+        json.dump({'success': True, 'code': 'SUCCESS', 'data': data, 'responseTimestamp': 1690000000000}, f)
+
+# Generating a directory tree shaped like the Pulse repository (root/data/...) with random values
+# Every category (aggregated, map, top) and kind (transaction, user) is written for the country and for each state,
+# the map files list the districts of the state and the top files the top states, districts and pincodes
+# As in the real data, the device breakdown of the users is null from 2022 Q2 on
+# Returns the number of files written
+def generate_pulse(root, scale=1, years=None, states=None, districts=None, pincodes=None, seed=0):
+    years = years or REAL_VOLUME['years']
+    states = states or REAL_VOLUME['states'] * scale
+    districts = districts or REAL_VOLUME['districts']
+    pincodes = pincodes or REAL_VOLUME['pincodes']
+    rnd = random.Random(seed)
+    count = lambda: rnd.randint(1000, 10**9)
+    amount = lambda: rnd.random() * 10**11
+    # The files name the states in lower case and their directories with dashes, like the Pulse repository
+    names_of_states = [name.lower() for name in state_names(states)]
+    files = 0
+    for year in range(2018, 2018 + years):
+        for quarter in range(1, 5):
+            for state in [None] + names_of_states:
+                scope = ['country', 'india'] + (['state', state.replace(' ', '-')] if state else [])
+                names = [f"{state} district {d}" for d in range(districts)] if state else names_of_states
+                top_districts = [f"district {d}" for d in rnd.sample(range(states * districts), min(10, states * districts))]
+                top_pincodes = [str(rnd.randint(110000, 855999)) for p in range(pincodes)]
+                top_states = None if state else rnd.sample(names_of_states, min(10, states))
+                devices = None if (year, quarter) >= (2022, 2) else \
+                    [{'brand': brand, 'count': count(), 'percentage': rnd.random()} for brand in BRANDS]
+
+                write_json(root, ['aggregated', 'transaction'] + scope, year, quarter, {
+                    'from': 0, 'to': 0,
+                    'transactionData': [{'name': t, 'paymentInstruments': [{'type': 'TOTAL', 'count': count(), 'amount': amount()}]}
+                                        for t in TRANSACTION_TYPES]})
+                write_json(root, ['aggregated', 'user'] + scope, year, quarter, {
+                    'aggregated': {'registeredUsers': count(), 'appOpens': count()}, 'usersByDevice': devices})
+                write_json(root, ['map', 'transaction', 'hover'] + scope, year, quarter, {
+                    'hoverDataList': [{'name': name, 'metric': [{'type': 'TOTAL', 'count': count(), 'amount': amount()}]}
+                                      for name in names]})
+                write_json(root, ['map', 'user', 'hover'] + scope, year, quarter, {
+                    'hoverData': {name: {'registeredUsers': count(), 'appOpens': count()} for name in names}})
+                write_json(root, ['top', 'transaction'] + scope, year, quarter, {
+                    category: entries and [{'entityName': name, 'metric': {'type': 'TOTAL', 'count': count(), 'amount': amount()}}
+                                           for name in entries]
+                    for category, entries in (('states', top_states), ('districts', top_districts), ('pincodes', top_pincodes))})
+                write_json(root, ['top', 'user'] + scope, year, quarter, {
+                    category: entries and [{'name': name, 'registeredUsers': count()} for name in entries]
+                    for category, entries in (('states', top_states), ('districts', top_districts), ('pincodes', top_pincodes))})
+                files += 6
+    return files
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset in the layout of the PhonePe Pulse repository")
+    parser.add_argument("root", help="directory to write the dataset into, the files go under root/data")
+    parser.add_argument("--scale", type=int, default=1, help="multiple of the real data volume")
+    parser.add_argument("--years", type=int)
+    parser.add_argument("--states", type=int)
+    parser.add_argument("--districts", type=int, help="districts per state")
+    parser.add_argument("--pincodes", type=int, help="top pincodes per file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    files = generate_pulse(args.root, args.scale, args.years, args.states, args.districts, args.pincodes, args.seed)
+    print(f"{files} files written to {args.root} in {time.perf_counter() - start:.2f}s")
@@ -1,15 +1,24 @@
 import pandas as pd
 import streamlit as st
-from configparser import ConfigParser
-from mysql.connector import connect, Error
 import plotly.express as px
 import plotly.graph_objects as go
-from sqlalchemy import create_engine
 from sqlalchemy import text
-from urllib.request import urlopen
-import json
+from sqlalchemy.exc import SQLAlchemyError
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from millify import millify
-from PhonePe_Data import execute_github_data_extraction
+from PhonePe_Refresh import start_refresher
+from PhonePe_DB import engine, section_config, select_hint, backend, star_schema, database_identity
+from PhonePe_Data import DIMENSIONS
+from PhonePe_Snapshot import current_snapshot, open_table, filter_table, has_table, read_geometry, snapshot_config
+from PhonePe_Geo import geo_config, india_geometry
+from PhonePe_Metrics import count, observe, timer, write_metrics
+from PhonePe_Cache import cache_config, data_cache, data_version, figure_cache, figure_config
+from PhonePe_Analytics import RANKINGS, TREND_COLUMNS, period_label, latest_period, growth_text, rank_entities
 
 st.set_page_config(
     page_title="Dynamic Phonepe Dashboard",
@@ -17,117 +26,324 @@ st.set_page_config(
     layout="wide"
     )
 
-@st.cache_data
-def config(filename='database.ini', section='mysql'):
-    parser = ConfigParser()
-    parser.read(filename)
-  
-    # get section, default to mysql
-    conn_param = []
-    if parser.has_section(section):
-        params = parser.items(section)
-        for p in params:
-            conn_param.append(p[1])
-    else:
-        raise Exception('Section {0} not found in the {1} database config file'.format(section, filename))
-  
-    return conn_param
+# Dashboard settings, the [dashboard] section
+# source: mysql (the database of the [storage] backend, falls back to the snapshot when it can not be read) or snapshot
+# database: the database the dashboard reads from
+# concurrency: independent reads of a view run at the same time, 1 reads them one after another
+# workers: threads of the process running the concurrent reads of every session, keep it within the
+# pool_size + max_overflow connections of the [pool] settings
+def dashboard_config():
+    return section_config('dashboard', {'source': 'mysql', 'database': 'phonepe', 'concurrency': 3, 'workers': 8})
 
-# Establishing MySQL Connection
-@st.cache_resource
+# Establishing the database connection, the engine and its pool are shared with the ingestion in this process
 def dbconnection():
-    params = config()
-    params.append("phonepe")
-    try:
-        return create_engine(url="mysql+mysqlconnector://{0}:{1}@{2}:{3}/{4}".format(*params))
-    except Error as e:
-        print("Error during establishing MySQL connection: ",e)
-
-@st.cache_data
-def data_extraction(type):    
+    return engine(dashboard_config()['database'])
+
+# Settings the figures depend on besides their data, part of the keys of the cached figures: the database they are
+# read from (or the snapshot directory) and the geometry of the maps
+def figure_identity():
+    settings = dashboard_config()
+    source = snapshot_config()['directory'] if settings['source'] == 'snapshot' else database_identity(settings['database'])
+    return source, geo_config()['tolerance'], geo_config()['precision']
+
+# Simplified and quantized state geometry of the [geo] settings, loaded once per process from the current
+# snapshot when it was published with it, else built from the GeoJSON
+@st.cache_resource
+def geometry():
+    settings = geo_config()
+    path = current_snapshot()
+    published = read_geometry(path, settings['tolerance'], settings['precision']) if path else None
+    return published or india_geometry(settings['filename'], settings['tolerance'], settings['precision'])
+
+# Reading from a shared data plane: the snapshot directory is shared by every dashboard process of the host,
+# which memory-map the same tables instead of holding copies of them
+def shared_plane():
+    return dashboard_config()['source'] == 'snapshot' and snapshot_config()['shared']
+
+# Caching the results of a view in the process, except on a shared data plane where they are read from the
+# mapped tables on every call, so an additional dashboard process holds no copies of the data
+def view_cache(tables, versions, max_entries=None):
+    def decorate(function):
+        return function if shared_plane() else data_cache(tables, versions, max_entries)(function)
+    return decorate
+
+# Threads running the concurrent reads of every session, started once per process
+@st.cache_resource
+def read_pool():
+    return ThreadPoolExecutor(max_workers=dashboard_config()['workers'], thread_name_prefix='phonepe-read')
+
+# Running independent reads at the same time and returning their results in order, so a view costs about its
+# slowest read instead of the total of them. At most concurrency reads of a call are in flight at once; the
+# reads run with the script context of the session, which the cached functions they call rely on.
+# Reads started from a read of the pool run one after another, they would otherwise wait on their own pool
+def run_concurrently(*reads):
+    limit = dashboard_config()['concurrency']
+    if limit <= 1 or len(reads) <= 1 or threading.current_thread().name.startswith('phonepe-read'):
+        return [read() for read in reads]
+    ctx = get_script_run_ctx(suppress_warning=True)
+    def run(read):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return read()
+    slots = threading.BoundedSemaphore(limit)
+    futures = []
+    for read in reads:
+        slots.acquire()
+        future = read_pool().submit(run, read)
+        future.add_done_callback(lambda future: slots.release())
+        futures.append(future)
+    return [future.result() for future in futures]
+
+# Tables of a snapshot opened so far, by name. The current and the previous snapshot stay open, an older one
+# is unmapped once it is evicted, so a removed snapshot does not keep its pages alive in a long running process
+@st.cache_resource(max_entries=2)
+def snapshot_tables(path):
+    return {}
+
+# Opening a table of the columnar snapshot once per process, memory-mapped
+def snapshot_table(path, table):
+    tables = snapshot_tables(path)
+    if table not in tables:
+        tables[table] = open_table(path, table)
+    return tables[table]
+
+# Reading the given columns of a table with its name columns as categoricals, filtered by equality on the
+# keyword arguments and by periods. With the star schema the names filtered on are looked up as ids, unknown
+# names match no row
+def read_table(table, columns, distinct=False, periods=None, **filters):
+    if star_schema():
+        filters = {column: dimension_id(DIMENSIONS[column][0], value) if column in DIMENSIONS else value
+                   for column, value in filters.items()}
+    return categorical_columns(read_rows(table, columns, distinct, periods, **filters))
+
+# Reading the given columns of a table as stored, filtered on the server by equality on the keyword arguments
+# and, when periods is given, to the quarters from first to last, (first, last) as year * 4 + quarter, either
+# None for an open range. Table and column names come from the code, the filter values are always bound parameters
+# In snapshot mode, or when the database can not be read, the table is read from the columnar snapshot
+def read_rows(table, columns, distinct=False, periods=None, **filters):
+    if dashboard_config()['source'] != 'snapshot':
+        query = f"SELECT {select_hint()}{'DISTINCT ' if distinct else ''}{', '.join(columns)} FROM {table}"
+        conditions = [f"{column} = :{column}" for column in filters]
+        params = dict(filters)
+        for bound, operator, value in zip(('first_period', 'last_period'), ('>=', '<='), periods or ()):
+            if value is not None:
+                conditions.append(f"year * 4 + quarter {operator} :{bound}")
+                params[bound] = value
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        try:
+            with timer('phonepe_query_seconds', table=table, source=backend()), dbconnection().connect() as conn:
+                df = pd.read_sql(text(query), conn, params=params)
+            count('phonepe_query_rows_total', len(df), table=table, source=backend())
+            return df
+        # pandas raises its own DatabaseError for the engines it reads through their DBAPI connection (duckdb)
+        except (SQLAlchemyError, pd.errors.DatabaseError) as e:
+            count('phonepe_query_errors_total', table=table)
+            print("Error during reading data from the database: ",e)
+    path = current_snapshot()
+    if path is None or not has_table(path, table):
+        return pd.DataFrame(columns=columns)
+    with timer('phonepe_query_seconds', table=table, source='snapshot'):
+        df = filter_table(snapshot_table(path, table), columns, periods, **filters)
+        df = df.drop_duplicates(ignore_index=True) if distinct else df
+    count('phonepe_query_rows_total', len(df), table=table, source='snapshot')
+    return df
+
+# Data version of every table, read again every version_ttl_seconds and right after a refresh changed the data
+@st.cache_data(ttl=cache_config()['version_ttl_seconds'])
+def table_versions():
+    df = read_rows("data_version", ["table_name", "version"])
+    return dict(zip(df['table_name'].astype(str), df['version'].astype(int)))
+
+# Names of a dimension table of the star schema in the order of their ids, ids start at 1
+def read_dimension_names(table):
+    df = read_rows(table, ["id", "name"])
+    return df.sort_values("id")["name"].tolist()
+
+@data_cache(lambda table: (table,), table_versions, max_entries=16)
+def dimension_names(table):
+    return read_dimension_names(table)
+
+# Ids of the names of a dimension table, keyed on the lower cased names like the comparisons of the backends
+@data_cache(lambda table: (table,), table_versions, max_entries=16)
+def dimension_ids(table):
+    return {name.lower(): id for id, name in enumerate(dimension_names(table), 1)}
+
+# Id of a name of a dimension table, 0 (no row) for an unknown name
+# A refresh can add names before table_versions reads its new version, a name missing from the cached ids is
+# looked up again in the dimension table
+def dimension_id(table, name):
+    key = str(name).lower()
+    id = dimension_ids(table).get(key)
+    if id is None:
+        id = {name.lower(): id for id, name in enumerate(read_dimension_names(table), 1)}.get(key, 0)
+    return id
+
+# Turning the name columns into categoricals holding only the names present: decoded from their dense ids
+# with the star schema, so a code is the id - 1, and encoded from the names otherwise
+def categorical_columns(df):
+    for column in df.columns.intersection(list(DIMENSIONS)):
+        if star_schema():
+            codes = df[column].to_numpy(dtype='int64') - 1
+            names = dimension_names(DIMENSIONS[column][0])
+            # Rows of a refresh can hold ids newer than the cached names until table_versions reads the new version,
+            # the names are then read again. Ids still unknown (a refresh between the two reads) decode as missing
+            if len(codes) and codes.max() >= len(names):
+                names = read_dimension_names(DIMENSIONS[column][0])
+                codes[codes >= len(names)] = -1
+            df[column] = pd.Categorical.from_codes(codes, names).remove_unused_categories()
+        else:
+            df[column] = df[column].astype('category')
+    return df
+
+# Tables read by the views, their data versions are part of the cache keys
+MAP_TABLES = {"***Transactions***": "map_trans_country", "***User***": "map_user_country"}
+VIEW_TABLES = {"***Transactions***": ("agg_trans_country", "top_trans_country", "map_trans_country"),
+               "***User***": ("agg_user_country", "top_user_country", "map_user_country")}
+map_tables = lambda type, year, quarter: (MAP_TABLES[type],) if type in MAP_TABLES else ()
+
+@view_cache(map_tables, table_versions, max_entries=64)
+def data_extraction(type, year, quarter):
     df = pd.DataFrame()
-    try:
-        with dbconnection().connect() as conn:
-            if type == "***Transactions***":
-                df = pd.read_sql("SELECT * from map_trans_country", conn)
-                #df = pd.read_sql("SELECT * from map_trans_state", conn)
-            elif type == "***User***":
-                df = pd.read_sql("SELECT * from map_user_country", conn)
-        return df
-    except Error as e:
-        print("Error during reading data from MySQL: ",e)
-    finally:
-        conn.close()
-
-@st.cache_data
+    if type == "***Transactions***":
+        df = read_table("map_trans_country", ["state", "transaction_count", "transaction_amount"],
+                        year=year, quarter=quarter)
+    elif type == "***User***":
+        df = read_table("map_user_country", ["state", "registered_users", "app_opens"],
+                        year=year, quarter=quarter)
+    return df
+
+# Data of the choropleth, the ingestion stores the state names as they are named in the GeoJSON
 def plot_data(type, year, quarter):
-    df = data_extraction(type)
-    # Data Preprocessing
-    df['state'] = df['state'].str.title()
-    df['state'] = df['state'].replace('Andaman & Nicobar Islands', 'Andaman & Nicobar',regex=True)
-    df['state'] = df['state'].replace('Dadra & Nagar Haveli & Daman & Diu', 'Dadra and Nagar Haveli and Daman and Diu',regex=True)
-    filtered_data = df[(df['year'] == year) & (df['quarter'] == quarter)]
-    return filtered_data
-
-@st.cache_data
+    return data_extraction(type, year, quarter)
+
+# Reports of the Country view, the three tables are read concurrently. The map data is the cached data of
+# the choropleth, so the choropleth of the period needs no read of its own afterwards
+@view_cache(lambda type, year, quarter: VIEW_TABLES.get(type, ()), table_versions, max_entries=64)
 def display_data(type, year, quarter):
-    agg_trans_df = pd.DataFrame()
-    top_trans_df = pd.DataFrame()
-    agg_user_df = pd.DataFrame()
-    top_user_df = pd.DataFrame()
-    try:
-        with dbconnection().connect() as conn:
-            if type == "***Transactions***":
-                agg_trans_df = pd.read_sql("SELECT * from agg_trans_country", conn)
-                top_trans_df = pd.read_sql("SELECT * from top_trans_country", conn)
-                map_df = pd.read_sql("SELECT * from map_trans_country", conn)
-                filtered_agg_trans_df = agg_trans_df[(agg_trans_df['year'] == year) & (agg_trans_df['quarter'] == quarter)]
-                filtered_top_trans_df = top_trans_df[(top_trans_df['year'] == year) & (top_trans_df['quarter'] == quarter)]
-                return filtered_agg_trans_df, filtered_top_trans_df, map_df
-            elif type == "***User***":
-                agg_user_df = pd.read_sql("SELECT * from agg_user_country", conn)
-                top_user_df = pd.read_sql("SELECT * from top_user_country", conn)
-                map_user_df = pd.read_sql("SELECT * from map_user_country", conn)                
-                filtered_map_user_df = map_user_df[(map_user_df['year'] == year) & (map_user_df['quarter'] == quarter)]
-                filtered_top_user_df = top_user_df[(top_user_df['year'] == year) & (top_user_df['quarter'] == quarter)]
-                return agg_user_df, filtered_top_user_df, filtered_map_user_df
-        
-    except Error as e:
-        print("Error during reading data from MySQL: ",e)
-    finally:
-        conn.close()
+    if type == "***Transactions***":
+        agg_trans_df, top_trans_df, map_df = run_concurrently(
+            partial(read_table, "agg_trans_country", ["transaction_type", "transaction_count", "transaction_amount"],
+                    year=year, quarter=quarter),
+            partial(read_table, "top_trans_country", ["cat_type", "type_name", "transaction_count", "transaction_amount"],
+                    year=year, quarter=quarter),
+            partial(data_extraction, type, year, quarter))
+        return agg_trans_df, top_trans_df, map_df
+    elif type == "***User***":
+        agg_user_df, top_user_df, map_user_df = run_concurrently(
+            partial(read_table, "agg_user_country", ["brand_name", "user_count", "percentage"],
+                    year=year, quarter=quarter),
+            partial(read_table, "top_user_country", ["cat_type", "type_name", "registered_users"],
+                    year=year, quarter=quarter),
+            partial(data_extraction, type, year, quarter))
+        return agg_user_df, top_user_df, map_user_df
+
+# Queries behind the insights: the table, its columns and the columns filtered on the state and district
+# arguments of query_processor
+# Insights 1 - 5 read the rollup tables and Insights 6 - 10 the trend tables that are maintained by the ingestion
+query_dic = {1 : ("rollup_trans_year", ["year", "transaction_type", "Amount", "Count"], ()),
+             2 : ("rollup_trans_state_year", ["state", "year", "transaction_type", "Amount", "Count"], ()),
+             3 : ("rollup_user_year", ["year", "brand_name", "User_Count", "Percentage"], ()),
+             4 : ("rollup_user_state_year", ["state", "year", "brand_name", "User_Count", "Percentage"], ()),
+             5 : ("rollup_top_trans_year", ["year", "cat_type", "type_name", "Count", "Amount"], ()),
+             6 : ("trend_transaction_type", ["transaction_type", "year", "quarter", "transaction_amount", "qoq_growth",
+                                             "yoy_growth", "rolling_amount"], ()),
+             7 : ("trend_state", ["state", "year", "quarter", "transaction_amount", "qoq_growth", "yoy_growth",
+                                  "amount_rank", "rank_change"], ()),
+             8 : ("trend_state", ["state", "year", "quarter", "transaction_amount", "amount_rank", "rank_change"], ()),
+             9 : ("trend_state_type", ["state", "transaction_type", "year", "quarter", "cumulative_amount", "yoy_growth"], ()),
+             10 : ("trend_district", ["state", "distrct", "year", "quarter", "transaction_amount", "yoy_growth",
+                                      "amount_rank", "rank_change"], ())
+             }
+query_tables = lambda choice, *args: (query_dic[choice][0],) if query_dic.get(choice) else ()
 
 # Function to process the SQL query based on user's choice and returns dataframe
-@st.cache_data
+@view_cache(query_tables, table_versions)
 def query_processor(choice, state=None, district=None):
-    query_dic = {1 : "select year, transaction_type, sum(transaction_amount) AS Amount, sum(transaction_count) AS Count from agg_trans_country group by transaction_type, year",
-                 2 : "select state, year, transaction_type, sum(transaction_amount) AS Amount, sum(transaction_count) AS Count from agg_trans_state group by transaction_type, year, state",
-                 3 : "SELECT year, brand_name, SUM(user_count) AS User_Count, SUM(percentage) AS Percentage FROM agg_user_country GROUP BY year, brand_name",
-                 4 : "SELECT state, year, brand_name, SUM(user_count) AS User_Count, SUM(percentage) AS Percentage FROM agg_user_state GROUP BY state, year, brand_name",
-                 5 : "SELECT year, cat_type, type_name, SUM(transaction_count) AS Count, SUM(transaction_amount) AS Amount from top_trans_country GROUP BY year, cat_type, type_name",
-                 6 : "",
-                 7 : "",
-                 8 : "",
-                 9 : "",
-                 10 : "",
-                 11 : "SELECT DISTINCT(state) FROM map_trans_state",
-                 12 : f"SELECT DISTINCT(distrct) FROM map_trans_state WHERE state='{state}'",
-                 13 : f"SELECT * FROM map_trans_state WHERE state='{state}' AND distrct='{district}'"
-                 }
-    try:
-        with dbconnection().connect() as conn:
-            df = pd.read_sql(query_dic[choice], conn)
-            return df
-    except Error as e:
-        print("Error during reading Insight Data: ",e)
-    finally:
-        conn.close()
+    table, columns, filter_columns = query_dic[choice]
+    filters = dict(zip(filter_columns, (state, district)))
+    return read_table(table, columns, **filters)
 
-# Function to process the dataframe and returns chart object
-@st.cache_data
-def data_processor(choice):
+# Top (or with bottom, the bottom) k states or districts of a map table by a metric, over the quarters from start
+# to end, (year, quarter) pairs included in the range, every quarter when they are not given, and within a state
+# when one is given. Cached per data version of the table; the arguments are passed positionally
+@view_cache(lambda table, *args: (table,), table_versions, max_entries=64)
+def ranking(table, metric, k=10, bottom=False, start=None, end=None, state=None):
+    columns = list(RANKINGS[table]['keys']) + ['year', 'quarter', metric]
+    periods = tuple(quarter[0] * 4 + quarter[1] if quarter else None for quarter in (start, end))
+    df = read_table(table, columns, periods=periods, **({'state': state} if state else {}))
+    return rank_entities(df, table, metric, k, bottom)
+
+# Index of the state view: state -> district -> transactions of the district by year and quarter, both levels
+# in sorted order. Built from a single read of map_trans_state once per data version of the table and shared,
+# not copied, by every session of the process, so the frames must not be modified. The previous version is
+# kept until the sessions still rendering it are done. On a shared data plane there is no index, it would be a
+# private copy of map_trans_state in every process: the mapped table is filtered on every call instead
+DISTRICT_COLUMNS = ["country", "state", "year", "quarter", "distrct", "transaction_count", "transaction_amount"]
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def district_index(version):
+    with timer('phonepe_render_seconds', step='district_index'):
+        df = read_table("map_trans_state", DISTRICT_COLUMNS)
+        index = {}
+        if df.empty:
+            return index
+        df = df.astype({'state': str, 'distrct': str}).sort_values(['state', 'distrct', 'year', 'quarter'])
+        for (state, district), series in df.groupby(['state', 'distrct'], sort=False):
+            index.setdefault(state, {})[district] = series.reset_index(drop=True)
+        return index
+
+# Index of the current data version of map_trans_state
+def current_district_index():
+    return district_index(data_version(("map_trans_state",), table_versions))
+
+# States of the state view
+def index_states():
+    if shared_plane():
+        return sorted(read_table("map_trans_state", ["state"], distinct=True)['state'].astype(str))
+    return list(current_district_index())
+
+# Districts of a state, empty for an unknown state
+def index_districts(state):
+    if shared_plane():
+        return sorted(read_table("map_trans_state", ["distrct"], distinct=True, state=state)['distrct'].astype(str))
+    return list(current_district_index().get(state, {}))
+
+# Transactions of a district by year and quarter, an empty frame for an unknown state or district
+def district_series(state, district):
+    if shared_plane():
+        df = read_table("map_trans_state", DISTRICT_COLUMNS, state=state, distrct=district)
+        return df.astype({'state': str, 'distrct': str}).sort_values(['year', 'quarter']).reset_index(drop=True)
+    series = current_district_index().get(state, {}).get(district)
+    return pd.DataFrame(columns=DISTRICT_COLUMNS) if series is None else series
+
+# Dataframe of an insight
+def insight_data(choice):
     df = query_processor(choice)
-    fig = ""
+    if choice >= 6:
+        # A trend column holding only NULLs (no trends yet, or a single year without year over year growth)
+        # is read as objects, which can not be sorted or ranked as numbers
+        df = df.astype({column: 'float64' for column, sqltype in TREND_COLUMNS
+                        if column in df.columns and df[column].dtype == object})
+    if choice == 5:
+        df = df[df['cat_type'] == 'states']
+        # Sort the states_df dataframe by 'Count' in descending order within each year
+        df = df.sort_values(by=['year'], ascending=[False])
+    elif choice in (6, 8):
+        df = df.sort_values(by=['year', 'quarter'])
+        df.insert(0, 'period', period_label(df))
+    elif choice in (7, 9):
+        df = latest_period(df).sort_values(by='yoy_growth' if choice == 7 else 'cumulative_amount', ascending=False)
+    elif choice == 10:
+        # Top 20 districts of the latest quarter by growth
+        df = latest_period(df).dropna(subset=['yoy_growth']).nlargest(20, 'yoy_growth')
+    return df.reset_index(drop=True) if choice >= 6 else df
+
+# Chart of an insight, pre-rendered once per data version
+@figure_cache('insight', query_tables, table_versions, figure_identity)
+def insight_figure(choice):
+    df = insight_data(choice)
+    start = time.perf_counter()
+    fig = go.Figure()
     if choice == 1:
         fig = px.bar(df, y="transaction_type", x="Amount",
                              color="Count", 
@@ -173,10 +389,6 @@ def data_processor(choice):
                         color_continuous_scale='rainbow',
                         height=800)
     elif choice == 5:
-        df = df[df['cat_type'] == 'states']
-        # Sort the states_df dataframe by 'Count' in descending order within each year
-        df = df.sort_values(by=['year'], ascending=[False])
-
         fig = px.bar(
             df,
             y='type_name',
@@ -190,17 +402,125 @@ def data_processor(choice):
         )
         fig.update_layout(xaxis = {"categoryorder":"total descending"})
     elif choice == 6:
-        pass
+        fig = px.line(df, x='period', y='yoy_growth', color='transaction_type', markers=True,
+                      hover_data={'qoq_growth': ':.1%', 'rolling_amount': ':.3s'},
+                      labels={'period': 'Quarter', 'yoy_growth': 'YoY Growth', 'transaction_type': 'Transaction Type',
+                              'qoq_growth': 'QoQ Growth', 'rolling_amount': 'Rolling 4Q Amount'},
+                      title='Year-over-Year Growth by Transaction Type',
+                      height=600)
+        fig.update_yaxes(tickformat='.0%')
     elif choice == 7:
-        pass
+        fig = px.bar(df, x='state', y='yoy_growth', color='qoq_growth',
+                     hover_data={'amount_rank': True, 'rank_change': True, 'transaction_amount': ':.3s'},
+                     labels={'state': 'State', 'yoy_growth': 'YoY Growth', 'qoq_growth': 'QoQ Growth',
+                             'amount_rank': 'Rank', 'rank_change': 'Rank Change', 'transaction_amount': 'Amount (Rs.)'},
+                     title=f"Year-over-Year Growth by State ({period_label(df).iloc[0] if len(df) else 'no data'})",
+                     height=600)
+        fig.update_yaxes(tickformat='.0%')
+        fig.update_coloraxes(colorbar_tickformat='.0%')
     elif choice == 8:
-        pass
+        fig = px.line(df, x='period', y='amount_rank', color='state',
+                      hover_data={'rank_change': True, 'transaction_amount': ':.3s'},
+                      labels={'period': 'Quarter', 'amount_rank': 'Rank', 'state': 'State', 'rank_change': 'Rank Change',
+                              'transaction_amount': 'Amount (Rs.)'},
+                      title='State Rank by Transaction Value',
+                      height=800)
+        fig.update_yaxes(autorange='reversed', dtick=5)
     elif choice == 9:
-        pass
+        fig = px.bar(df, x='cumulative_amount', y='state', color='transaction_type', orientation='h',
+                     labels={'cumulative_amount': 'Cumulative Amount (Rs.)', 'state': 'State',
+                             'transaction_type': 'Transaction Type'},
+                     title='Cumulative Transaction Value by State',
+                     height=1000)
+        fig.update_layout(yaxis={"categoryorder": "total ascending"})
     elif choice == 10:
-        pass
-               
-    return fig,df               
+        fig = px.bar(df, x='yoy_growth', y='distrct', color='state', orientation='h',
+                     hover_data={'amount_rank': True, 'rank_change': True, 'transaction_amount': ':.3s'},
+                     labels={'yoy_growth': 'YoY Growth', 'distrct': 'District', 'state': 'State', 'amount_rank': 'Rank in State',
+                             'rank_change': 'Rank Change', 'transaction_amount': 'Amount (Rs.)'},
+                     title='Fastest Growing Districts (Year over Year)',
+                     height=700)
+        fig.update_xaxes(tickformat='.0%')
+        fig.update_layout(yaxis={"categoryorder": "total ascending"})
+    observe('phonepe_render_seconds', time.perf_counter() - start, step='figure', choice=choice)
+    return fig
+
+# Facts of a trend insight, read from its dataframe
+def trend_facts(choice, df):
+    if df.empty:
+        return ["- Trends are computed by the next data refresh."]
+    if choice == 6:
+        latest = latest_period(df).sort_values('yoy_growth', ascending=False)
+        return [f"- ***:blue[{row.transaction_type}]*** grew ***:orange[{growth_text(row.yoy_growth)}]*** year over year "
+                f"in {row.period}." for row in latest.itertuples()]
+    if choice == 7:
+        growth = df.dropna(subset=['yoy_growth'])
+        if growth.empty:
+            return []
+        first, last = growth.iloc[0], growth.iloc[-1]
+        return [f"- ***:blue[{first.state}]*** is the ***:orange[fastest growing]*** state ({growth_text(first.yoy_growth)}).",
+                f"- ***:blue[{last.state}]*** grew the ***:orange[least]*** ({growth_text(last.yoy_growth)})."]
+    if choice == 8:
+        latest = latest_period(df).dropna(subset=['rank_change'])
+        if latest.empty:
+            return []
+        up, down = latest.loc[latest['rank_change'].idxmax()], latest.loc[latest['rank_change'].idxmin()]
+        return [f"- ***:blue[{up.state}]*** climbed ***:orange[{int(up.rank_change)}]*** places to rank {int(up.amount_rank)} in {up.period}.",
+                f"- ***:blue[{down.state}]*** moved {int(down.rank_change)} places to rank {int(down.amount_rank)}."]
+    if choice == 9:
+        totals = df.groupby('state', observed=True)['cumulative_amount'].sum().sort_values(ascending=False)
+        return [f"- ***:blue[{totals.index[0]}]*** has the ***:orange[largest]*** transaction value to date "
+                f"(Rs. {millify(totals.iloc[0], precision=2)})."]
+    if choice == 10:
+        top = df.iloc[0]
+        return [f"- ***:blue[{top.distrct}]*** ({top.state}) is the ***:orange[fastest growing]*** district "
+                f"({growth_text(top.yoy_growth)})."]
+    return []
+
+# Function to process the dataframe and returns chart object
+def data_processor(choice):
+    return insight_figure(choice), insight_data(choice)
+
+# Choropleth of the states for the selected type, year and quarter, pre-rendered once per data version
+@figure_cache('choropleth', map_tables, table_versions, figure_identity)
+def choropleth_figure(type, year, quarter):
+    plot_df = plot_data(type, year, quarter)
+    color_field, hover_field = None, None
+    if type == "***Transactions***":
+        color_field = 'transaction_count'
+        hover_field = 'transaction_amount'
+    else:
+        color_field = 'registered_users'
+        hover_field = 'app_opens'
+    start = time.perf_counter()
+    fig = px.choropleth(plot_df, geojson=geometry(), 
+                        title=f"Aggregated {type.replace('*','')} Q{quarter} {year}:",
+                        color_continuous_scale="Turbo",
+                        center={"lat": 20.5937, "lon": 78.9629},
+                        locations='state', color=color_field, hover_name='state', 
+                        hover_data={'state':False, hover_field:':.2f'}, scope="asia")
+    fig.update_geos(fitbounds="locations", visible=False, 
+                    bgcolor="#121216")
+    fig.update_layout(width=800, height = 450, margin={"r":0,"t":30,"l":0,"b":0})
+    observe('phonepe_render_seconds', time.perf_counter() - start, step='choropleth')
+    return fig
+
+# Transactions of a district by year and quarter, pre-rendered once per data version
+@figure_cache('district', lambda state, district: ("map_trans_state",), table_versions, figure_identity)
+def district_figure(state, district):
+    df = district_series(state, district)
+    fig = px.bar(df, y="year", x="transaction_amount",
+                     color="transaction_count", 
+                     hover_data= ["quarter","transaction_count"],
+                     height=800,
+                     barmode='stack',
+                     orientation='h',
+                     facet_row='quarter',
+                     title="Country-wise Aggregated Transactions",
+                     text_auto=".3s",
+                     labels = dict(year = "Year", transaction_amount="Transaction Amount"))
+    fig.update_traces(textfont_size=13, textangle=0, textposition="outside", cliponaxis=False)            
+    return fig
             
 def front_end():    
     #st.divider()
@@ -217,7 +537,6 @@ def front_end():
     st.sidebar.subheader("Insights", divider="rainbow")
     
     insight = st.sidebar.toggle("Facts & Figures")
-    plot_df = plot_data(type, year, quarter)
        
     if insight:
         st.subheader("Few Insights from the PhonePe Pulse Data...", divider="rainbow")
@@ -226,8 +545,14 @@ def front_end():
         q3 = "Brand wise Analysis - Country Level"
         q4 = "Brand wise Analysis - State Level"
         q5 = "Top 10 States - Transactions"
+        q6 = "Growth Trends - Transaction Categories"
+        q7 = "Growth Trends - States"
+        q8 = "Rank Movement - States"
+        q9 = "Cumulative Transactions - States"
+        q10 = "Growth Trends - Districts"
+        trends = [q6, q7, q8, q9, q10]
 
-        qchoice = st.selectbox("Select any of the Analysis from the List:", ['Select any', q1, q2, q3, q4, q5])
+        qchoice = st.selectbox("Select any of the Analysis from the List:", ['Select any', q1, q2, q3, q4, q5] + trends)
         insight_col1, insight_col2 = st.columns([2,1])
         
         if qchoice == q1:
@@ -295,35 +620,28 @@ def front_end():
             new_col2.subheader("Facts: ",divider="rainbow")  
             new_col2.markdown("- ***:blue[Maharashtra]*** is the state with the ***:orange[largest]*** Transaction Count in the country.")
 
+        elif qchoice in trends:
+            choice = trends.index(qchoice) + 6
+            fig, df = data_processor(choice)
+            st.plotly_chart(fig, use_container_width=True)
+            new_col1, new_col2 = st.columns(2)
+            expander = new_col1.expander("Click here to see the Data...", expanded=False)
+            expander.dataframe(df)
+            new_col2.subheader("Facts: ",divider="rainbow")
+            for fact in trend_facts(choice, df):
+                new_col2.markdown(fact)
+
     else:
         st.header('PhonePe Pulse Data Visualization', divider="rainbow")
         col1, col2 = st.columns([2, 1])
         
-        india_states = json.load(open("india_states.geojson",'r'))
-        color_field, hover_field = None, None
-        if type == "***Transactions***":
-            color_field = 'transaction_count'
-            hover_field = 'transaction_amount'
-        else:
-            color_field = 'registered_users'
-            hover_field = 'app_opens'
-        
         if data == "***Country***":
-            fig = px.choropleth(plot_df, geojson=india_states, featureidkey='properties.ST_NM', 
-                                title=f"Aggregated {type.replace('*','')} Q{quarter} {year}:",
-                                color_continuous_scale="Turbo",
-                                center={"lat": 20.5937, "lon": 78.9629},
-                                locations='state', color=color_field, hover_name='state', 
-                                hover_data={'state':False, hover_field:':.2f'}, scope="asia")
-            fig.update_geos(fitbounds="locations", visible=False, 
-                            bgcolor="#121216")
-            fig.update_layout(width=800, height = 450, margin={"r":0,"t":30,"l":0,"b":0})
-
-            if plot_df.empty:
+            # The reports are read first, their concurrent reads include the data of the choropleth
+            agg_df, top_df, map_df = display_data(type, year, quarter)
+            if plot_data(type, year, quarter).empty:
                 col1.write(f"<br><br><h4 align=center>Data is not available for the selected Q{quarter} in the year {year}</h4>", unsafe_allow_html=True)
             else:
-                col1.write(fig)
-                agg_df, top_df, map_df = display_data(type, year, quarter)
+                col1.write(choropleth_figure(type, year, quarter))
                 col1.write()
 
                 if type == "***Transactions***":
@@ -372,7 +690,6 @@ def front_end():
                         df.index = df.index + 1
                         df.index.name = "#"
                         df.columns = ['States', 'Count']
-                        df['States'] = df['States'].str.title()
                         st.dataframe(df, column_config={
                             'Count' : st.column_config.NumberColumn(help = "Click to Sort",
                                                                     width = "medium")
@@ -384,7 +701,6 @@ def front_end():
                         df.index = df.index + 1
                         df.index.name = "#"
                         df.columns = ['Districts', 'Count']
-                        df['Districts'] = df['Districts'].str.title()
                         st.dataframe(df, column_config={
                             'Count' : st.column_config.NumberColumn(help = "Click to Sort",
                                                                     width = "medium")
@@ -434,7 +750,6 @@ def front_end():
                         df.index = df.index + 1
                         df.columns = ['States', 'Count']
                         df.index.name = "#"
-                        df['States'] = df['States'].str.title()
                         st.dataframe(df)
                     with tab2:
                         # Displaying Top 10 districts data
@@ -443,7 +758,6 @@ def front_end():
                         df.index = df.index + 1
                         df.columns = ['Districts', 'Count']
                         df.index.name = "#"
-                        df['Districts'] = df['Districts'].str.title()
                         st.dataframe(df)
                     with tab3:
                         # Displaying Top 10 Pincodes (Area) data
@@ -457,41 +771,74 @@ def front_end():
             # STATE WISE VISUALIZATION
             state_col1, state_col2 = st.columns(2)
 
-            # Retrieving state list from Database
+            # Retrieving state list from the index of the state view
             state_choice = state_col1.selectbox("State:", 
-                                                (query_processor(11).state).str.title(), 
+                                                index_states(), 
                                                 label_visibility='hidden') 
-            # Retrieving District List from Database
+            # Retrieving District List from the index of the state view
             district_choice = state_col2.selectbox("District:", 
-                                                   sorted((query_processor(12, state_choice).distrct).str.title()), 
+                                                   index_districts(state_choice), 
                                                    label_visibility='hidden') 
-            # Creating dataframe for the selected state and district
-            df = query_processor(13, state_choice, district_choice) 
-            
-            # Plotting Chart based on the dataframe
-            fig = px.bar(df, y="year", x="transaction_amount",
-                             color="transaction_count", 
-                             hover_data= ["quarter","transaction_count"],
-                             height=800,
-                             barmode='stack',
-                             orientation='h',
-                             facet_row='quarter',
-                             title="Country-wise Aggregated Transactions",
-                             text_auto=".3s",
-                             labels = dict(year = "Year", transaction_amount="Transaction Amount"))
-            fig.update_traces(textfont_size=13, textangle=0, textposition="outside", cliponaxis=False)            
-            st.write(fig)
+            # Plotting the chart of the selected state and district
+            st.write(district_figure(state_choice, district_choice))
 
         
 
 
 
+# Showing the state of the background data refresh in the sidebar
+def refresh_indicator(status):
+    if status['state'] in ('starting', 'running'):
+        st.sidebar.progress(status['progress'], text=f"Refreshing data ({status['stage'] or 'starting'})...")
+    elif status['state'] == 'failed':
+        st.sidebar.warning(f"Data refresh failed, showing the last loaded data: {status['last_error']}")
+    elif status['state'] == 'elsewhere':
+        st.sidebar.caption("Data refreshed by another dashboard process")
+    else:
+        st.sidebar.caption(f"Data version {status['version']}, refreshed at {status['last_refresh']}")
+
+# Pre-rendering the figures of the dashboard for the current data: the choropleth of every type, year and quarter,
+# the insights and, when districts is set, the chart of every district. Figures already rendered are skipped
+def warm_figures(districts=False):
+    start = time.perf_counter()
+    for type in MAP_TABLES:
+        for year in range(2018, 2024):
+            for quarter in range(1, 5):
+                if not plot_data(type, year, quarter).empty:
+                    choropleth_figure.warm(type, year, quarter)
+    for choice in range(1, 11):
+        insight_figure.warm(choice)
+    if districts:
+        for state in index_states():
+            for district in index_districts(state):
+                district_figure.warm(state, district)
+    print(f"Figures pre-rendered in {time.perf_counter() - start:.2f}s")
+
+# Reading the data versions again after a refresh changed the data, then pre-rendering the figures when configured
+def data_refreshed():
+    table_versions.clear()
+    if figure_config()['warm']:
+        warm_figures()
+
 # Main Function 
 def main():    
-    if 'github_status' not in st.session_state:
-        st.session_state.github_status = execute_github_data_extraction()
+    # The data is refreshed by a background thread started once per server, pages are served right away
+    # from the last committed data while a refresh runs. Cached results are keyed on the data version.
+    # In snapshot mode the dashboard is served from the last written snapshot, without touching MySQL
+    # After a refresh only the data versions are read again, the cached results of the unchanged tables stay valid
+    status = None
+    if dashboard_config()['source'] != 'snapshot':
+        status = start_refresher(on_refresh=data_refreshed)
     
-    front_end()
+    with timer('phonepe_render_seconds', step='page'):
+        front_end()
+    if status:
+        refresh_indicator(status)
+    write_metrics()
     
+# python PhonePe_VizApp.py --warm [--districts] pre-renders the figures into the [figures] directory ahead of time
 if __name__ == "__main__":
-    main() 
+    if "--warm" in sys.argv[1:]:
+        warm_figures(districts="--districts" in sys.argv[1:])
+    else:
+        main() 